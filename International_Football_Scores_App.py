@@ -1,60 +1,637 @@
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
+import flask
 import numpy as np
 import pandas as pd
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output
 import plotly.graph_objs as go
-import plotly.figure_factory as ff
-
-app = dash.Dash()
+from werkzeug.http import is_resource_modified
+
+from downsample import lttb
+from figure_cache import FigureCache
+from metrics import Metrics, stats_lines
+from ratings import Ratings, build_ratings, extend_ratings, load_ratings, rate_games, save_ratings
+from queries import VENUE_NAMES, PandasQueries, SqliteQueries, no_rows, write_database
+from responses import STREAM_TYPES, Compression, figure_patch, stream_rows
+from results_cache import align_dictionaries, load_appended, load_results, store_results
+from shared_cache import SharedCache
+from stats_cube import build_stats_cube, extend_stats_cube
+from trends import build_trends, extend_trends, form_ranking
+from warmup import Warmup
+
+app = dash.Dash(__name__)
 
 server = app.server
 
-#import the data into the script
-df = pd.read_csv('Data/results.csv')
-df_raw = df
-
-#convert the date to datetime, and create a new column showing just the year
-df['date'] = pd.to_datetime(df['date'])
-df['year'] = df['date'].dt.year
-
-#there is a lot of data so lets remove anything before 1975
-df = df[df['date'].dt.year >= 1975]
-
-#what we need to do here is plan for scores that are the same.
-#to show them all properly, I will add small random value to the columns that hold the scores
-#this will mean when you hover over, both will appear
+#where the data lives, these can be changed with environment variables
+#the cache folder holds a binary copy of the csv that loads much faster, set it to an empty value to turn it off
+RESULTS_CSV = os.environ.get('RESULTS_CSV', 'Data/results.csv')
+RESULTS_CACHE_DIR = os.environ.get('RESULTS_CACHE_DIR', 'Data/.cache') or None
+
+#where the callbacks get their rows from (see queries.py): 'pandas' keeps every table and index in memory,
+#'sqlite' reads the games from a sqlite file with indexes on team, year and pair, which every worker shares,
+#and the worker keeps none of the rows once they are written
+#the sqlite file goes in QUERY_DB_DIR, by default the results cache folder
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas').lower()
+QUERY_DB_DIR = os.environ.get('QUERY_DB_DIR') or RESULTS_CACHE_DIR or 'Data/.cache'
+if QUERY_BACKEND not in ('pandas', 'sqlite'):
+    raise ValueError('QUERY_BACKEND must be pandas or sqlite, not {!r}'.format(QUERY_BACKEND))
+
+#the form and trend lines on the time series and the form ranking look at each team's last FORM_GAMES games
+#(see trends.py), the ranking leaves out teams that have not played in the FORM_ACTIVE_YEARS before the latest game
+FORM_GAMES = int(os.environ.get('FORM_GAMES', 10))
+FORM_ACTIVE_YEARS = int(os.environ.get('FORM_ACTIVE_YEARS', 4))
+
+#there is a lot of data so the year slider starts at 1975, the head to head still uses every game since 1872
+FIRST_YEAR = 1975
+
+#what the page shows when it is opened, the team, the venue and the country the hover charts start with
+DEFAULT_TEAM = 'England'
+DEFAULT_VENUE = 'All'
+DEFAULT_COUNTRY = 'France'
+
+#most of the charts look at the games from one team's point of view, so rather than reshaping the data
+#on every request we build a second "long" table once, with one row per (match, team)
+#each match appears twice, once for the home team and once for the away team
+#the rows are sorted by team and then date, so all of a team's games sit next to each other in date order
+#'match' is the row position of the game in df_raw so we can get back to the original columns for the table
+#team and opponent keep the codes of the shared team dictionary (see results_cache.py) and venue is a code too,
+#so the tables and indexes below compare small integers rather than strings
+#tournament is kept as its code as well, so the tournament filter picks games out with a lookup on the code
+#fixtures that have not been played yet have no score, they are left out so every game in here has a result
+def build_long_table(frame, first_match=0):
+    matches = np.arange(first_match, first_match + len(frame), dtype=np.int32)
+    scored = (frame['home_score'].notna() & frame['away_score'].notna()).to_numpy()
+    if not scored.all():
+        frame, matches = frame[scored], matches[scored]
+    home = pd.DataFrame({
+        'match': matches,
+        'team': frame['home_team'].values,
+        'opponent': frame['away_team'].values,
+        'goals_for': frame['home_score'].values,
+        'goals_against': frame['away_score'].values,
+        'venue': pd.Categorical.from_codes(np.zeros(len(frame), dtype=np.int8), VENUE_NAMES),
+        'date': frame['date'].values,
+        'year': frame['year'].values,
+        'tournament': frame['tournament'].values,
+    })
+    away = pd.DataFrame({
+        'match': matches,
+        'team': frame['away_team'].values,
+        'opponent': frame['home_team'].values,
+        'goals_for': frame['away_score'].values,
+        'goals_against': frame['home_score'].values,
+        'venue': pd.Categorical.from_codes(np.ones(len(frame), dtype=np.int8), VENUE_NAMES),
+        'date': frame['date'].values,
+        'year': frame['year'].values,
+        'tournament': frame['tournament'].values,
+    })
+    long_table = pd.concat([home, away], ignore_index=True)
+    return long_table.sort_values(['team', 'date', 'match'], kind='mergesort').reset_index(drop=True)
+
+#this gives the start and end of each team's block of games in df_long, for views that span every year
+def build_team_slices(long_table):
+    codes = long_table['team'].cat.codes.to_numpy()
+    names = long_table['team'].cat.categories
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    stops = np.r_[starts[1:], len(codes)]
+    return {names[codes[start]]: (start, stop) for start, stop in zip(starts, stops)}
+
+#every callback used to start by scanning the whole dataframe for the year and then the team
+#instead we build an index once at startup that maps (team, year, venue) to the row positions of the matching games
+#venue is 'Home', 'Away' or 'All', and because df_long is sorted by team and date the positions come out in date order
+#the positions are counted from the start of the team's block, so adding games for one team does not move the others
+def build_team_year_index(long_table, team_slices):
+    index = {}
+    for (team, year), rows in long_table.groupby(['team', 'year'], observed=True).indices.items():
+        index[(team, year, 'All')] = rows - team_slices[team][0]
+    for (team, year, venue), rows in long_table.groupby(['team', 'year', 'venue'], observed=True).indices.items():
+        index[(team, year, venue)] = rows - team_slices[team][0]
+    return index
+
+#the head to head chart fires on every mouse move over the scatter, so the games between two teams are indexed too
+#each match is in the long table twice, we keep the copy where the team comes first alphabetically,
+#which is the copy with the smaller team code as the dictionary is sorted
+#for each pair we keep where those games are (counted from the start of the first team's block)
+#and running totals of net goals, wins, draws and losses, so the summary of all the meetings is just the last value
+def build_pair_index(long_table, team_slices):
+    first = long_table[long_table['team'].cat.codes.to_numpy() < long_table['opponent'].cat.codes.to_numpy()]
+    first = first.sort_values(['team', 'opponent', 'date', 'match'], kind='mergesort')
+    names = first['team'].cat.categories
+    teams = first['team'].cat.codes.to_numpy()
+    opponents = first['opponent'].cat.codes.to_numpy()
+    net = (first['goals_for'] - first['goals_against']).to_numpy()
+    team_starts = pd.Series({team: start for team, (start, stop) in team_slices.items()})
+    rows = first.index.to_numpy() - team_starts.reindex(names).to_numpy()[teams]
+    new_pair = np.r_[True, (teams[1:] != teams[:-1]) | (opponents[1:] != opponents[:-1])]
+    starts = np.flatnonzero(new_pair)
+    stops = np.r_[starts[1:], len(first)]
+    group = np.cumsum(new_pair) - 1
+
+    #a running total that starts again at zero for each pair
+    def running(values):
+        total = np.cumsum(values)
+        return total - np.r_[0, total][starts][group]
+
+    cum_net, cum_wins, cum_draws, cum_losses = running(net), running(net > 0), running(net == 0), running(net < 0)
+    return {(names[teams[start]], names[opponents[start]]): {'rows': rows[start:stop], 'cum_net': cum_net[start:stop],
+                                               'cum_wins': cum_wins[start:stop], 'cum_draws': cum_draws[start:stop],
+                                               'cum_losses': cum_losses[start:stop]}
+            for start, stop in zip(starts, stops)}
+
+
+#everything the callbacks read is kept together in one Dataset
+#when new results are loaded we build a new Dataset and swap it in with one assignment,
+#so a request never sees a mix of old and new data
+#the rows themselves are only held by the queries (see queries.py), with the sqlite backend they are in the shared
+#file and the worker keeps what is worked out from them, which grows with the number of teams and years rather than
+#with the number of games
+class Dataset(object):
+
+    #rows are the games the dataset was built from, or with old the games added to the end of old's
+    def __init__(self, version, size, rows, queries, stats, ratings, summary, old=None):
+        #the fingerprint of the csv and how many bytes of it we have loaded
+        self.version = version
+        self.size = size
+        #how many games the csv has and the date of the last one, a reload adds the games after them
+        self.games = len(rows) + (old.games if old is not None else 0)
+        self.last_date = rows['date'].iloc[-1] if len(rows) else old.last_date
+        #what the callbacks read their rows through
+        self.queries = queries
+        #running totals for every team, year and venue, for the year range view
+        self.stats = stats
+        #the Elo ratings (see ratings.py), a team's rating after each of its games comes with the games
+        self.ratings = ratings
+        #the points of each team's unzoomed rating chart, filled in as teams are looked at (see rating_points)
+        self.rating_points = {}
+        #every team's games, first and last game and latest form (see trends.py), the form and trend at each game
+        #come with the games too, and the ranking of the teams that still play
+        self.summary = summary
+        self.form_ranking = form_ranking(summary, FORM_GAMES, FORM_ACTIVE_YEARS).sort_values(['form', 'points'],
+                                                                                             ascending=False)
+        #the teams for the dropdown and the years for the slider, and every tournament for the tournament filter
+        #new rows can only add to the ones the old dataset had
+        recent = rows[rows['year'] >= FIRST_YEAR]
+        self.teams = np.asarray(recent['home_team'].cat.remove_unused_categories().cat.categories, dtype=object)
+        self.years = np.sort(recent['year'].unique())
+        self.tournaments = np.asarray(rows['tournament'].cat.remove_unused_categories().cat.categories, dtype=object)
+        if old is not None:
+            self.teams = np.union1d(old.teams, self.teams)
+            self.years = np.union1d(old.years, self.years)
+            self.tournaments = np.union1d(old.tournaments, self.tournaments)
+        self.loaded_at = time.time()
+        #when the csv was last changed, the data api sends it as Last-Modified
+        modified = os.path.getmtime(RESULTS_CSV) if os.path.exists(RESULTS_CSV) else self.loaded_at
+        self.modified = datetime.fromtimestamp(int(modified), timezone.utc)
+
+
+#the long table with each game's form and trend and the team's rating after it
+def with_trends(long_table, trends, ratings, first_match=0):
+    return long_table.assign(form=trends['form'].to_numpy(), trend=trends['trend'].to_numpy(),
+                             rating=ratings.by_game(long_table, first_match))
+
+
+#builds every table and index from scratch, this is what happens at startup
+def build_dataset(frame, version, size):
+    #make sure the rows are in date order and numbered 0..n, the tables and indexes rely on this
+    df_raw = frame.sort_values('date', kind='mergesort').reset_index(drop=True)
+    df_long = build_long_table(df_raw)
+    ratings = dataset_ratings(df_raw, version)
+    trends, summary = build_trends(df_long, FORM_GAMES)
+    df_long = with_trends(df_long, trends, ratings)
+    stats = build_stats_cube(df_long)
+    if QUERY_BACKEND == 'sqlite':
+        #the games go in the shared file, and the worker only keeps where the ratings carry on from
+        path = write_database(QUERY_DB_DIR, version, df_raw, df_long)
+        queries = SqliteQueries(path, df_long.dtypes, df_raw.dtypes)
+        return Dataset(version, size, df_raw, queries, stats, Ratings(None, None, ratings.current), summary)
+    team_slices = build_team_slices(df_long)
+    queries = PandasQueries(df_raw, df_long, team_slices, build_team_year_index(df_long, team_slices),
+                            build_pair_index(df_long, team_slices))
+    return Dataset(version, size, df_raw, queries, stats, ratings, summary)
+
+#the ratings are read from the results cache folder if they were saved for this version of the csv,
+#otherwise every game is rated and they are saved for the workers that start later
+def dataset_ratings(df_raw, version):
+    if RESULTS_CACHE_DIR is None:
+        return build_ratings(df_raw)
+    ratings = load_ratings(RESULTS_CACHE_DIR, version, len(df_raw))
+    if ratings is None:
+        ratings = build_ratings(df_raw)
+        save_ratings(RESULTS_CACHE_DIR, version, ratings)
+    return ratings
+
+
+#adds newly played games to a dataset without rebuilding it
+#new_rows must all be on or after the last date we already have, which is how new results arrive
+#the old dataset is not changed, in-flight requests can carry on using it
+def extend_dataset(old, new_rows, version, size):
+    new_rows = new_rows.sort_values('date', kind='mergesort').reset_index(drop=True)
+    if QUERY_BACKEND == 'sqlite':
+        return extend_sqlite_dataset(old, new_rows, version, size)
+    #the new rows may bring new teams, tournaments or cities, both sides then get the combined dictionaries
+    old_raw, new_rows = align_dictionaries(old.queries.df_raw, new_rows)
+    df_raw = pd.concat([old_raw, new_rows], ignore_index=True)
+    #the ratings carry on from where the old games left them
+    ratings = extend_ratings(old.ratings, new_rows)
+    new_long = build_long_table(new_rows, first_match=len(old_raw))
+    new_long['rating'] = ratings.by_game(new_long)
+    team_names = df_raw['home_team'].cat.categories
+    old_long = old.queries.df_long
+    old_slices = old.queries.team_slices
+    if not old_long['team'].cat.categories.equals(team_names):
+        old_long = old_long.assign(team=old_long['team'].cat.set_categories(team_names),
+                                   opponent=old_long['opponent'].cat.set_categories(team_names))
+    if not old_long['tournament'].cat.categories.equals(df_raw['tournament'].cat.categories):
+        old_long = old_long.assign(tournament=old_long['tournament'].cat.set_categories(
+            df_raw['tournament'].cat.categories))
+
+    #each new game goes at the end of its team's block, the blocks are in team order so we can find the spot
+    #with a binary search, and np.insert keeps the new games in the order we give them
+    new_codes = new_long['team'].cat.codes.to_numpy()
+    new_teams = np.asarray(team_names, dtype=object)[new_codes]
+    insert_at = np.searchsorted(old_long['team'].cat.codes.to_numpy(), new_codes, side='right')
+    order = np.insert(np.arange(len(old_long)), insert_at, np.arange(len(old_long), len(old_long) + len(new_long)))
+    df_long = pd.concat([old_long, new_long], ignore_index=True).iloc[order].reset_index(drop=True)
+    #the form and trend are worked out again for the whole table, it only takes a few running totals
+    trends, summary = build_trends(df_long, FORM_GAMES)
+    df_long['form'] = trends['form'].to_numpy()
+    df_long['trend'] = trends['trend'].to_numpy()
+
+    #the blocks only grow, so the new starts are a running total of the new block lengths
+    new_counts = pd.Series(new_teams).value_counts()
+    team_slices = {}
+    start = 0
+    for team in sorted(set(old_slices) | set(new_counts.index)):
+        old_start, old_stop = old_slices.get(team, (0, 0))
+        length = old_stop - old_start + int(new_counts.get(team, 0))
+        team_slices[team] = (start, start + length)
+        start += length
+
+    #where each new game sits in its team's block, which is after all the games the team already had
+    new_long['rank'] = new_long.groupby(new_codes).cumcount()
+    old_lengths = pd.Series({team: stop - start for team, (start, stop) in old_slices.items()})
+    new_long['rel'] = new_long['rank'].to_numpy() + old_lengths.reindex(new_teams).fillna(0).astype(int).to_numpy()
+
+    #only the index entries for the teams and years that got new games are touched
+    team_year_index = dict(old.queries.team_year_index)
+    new_rel = new_long['rel'].to_numpy()
+    for keys, venue_keys in ((['team', 'year'], False), (['team', 'year', 'venue'], True)):
+        for key, rows in new_long.groupby(keys, observed=True).indices.items():
+            key = tuple(key) if venue_keys else tuple(key) + ('All',)
+            previous = team_year_index.get(key, no_rows)
+            team_year_index[key] = np.concatenate([previous, new_rel[rows]])
+
+    #and only the pairs that played each other get longer, their running totals carry on from where they were
+    pair_index = dict(old.queries.pair_index)
+    first = new_long[new_codes < new_long['opponent'].cat.codes.to_numpy()]
+    first_rel = first['rel'].to_numpy()
+    first_net = (first['goals_for'] - first['goals_against']).to_numpy()
+    for key, rows in first.groupby(['team', 'opponent'], observed=True).indices.items():
+        net = first_net[rows]
+        entry = pair_index.get(tuple(key))
+        previous = entry if entry is not None else {'rows': no_rows, 'cum_net': no_rows, 'cum_wins': no_rows,
+                                                    'cum_draws': no_rows, 'cum_losses': no_rows}
+        updated = {'rows': np.concatenate([previous['rows'], first_rel[rows]])}
+        for name, values in (('cum_net', net), ('cum_wins', net > 0), ('cum_draws', net == 0), ('cum_losses', net < 0)):
+            carried = previous[name][-1] if len(previous[name]) else 0
+            updated[name] = np.concatenate([previous[name], carried + np.cumsum(values)])
+        pair_index[tuple(key)] = updated
+
+    queries = PandasQueries(df_raw, df_long, team_slices, team_year_index, pair_index)
+    return Dataset(version, size, new_rows, queries, extend_stats_cube(old.stats, new_long), ratings, summary, old)
+
+#with sqlite the old games are only in the old file, so the new ones are worked out on their own: the ratings carry
+#on from each team's latest rating and the form from the last few games of the teams that played, read back from
+#the file. The file is copied and only the new games are added to the copy (see write_database)
+def extend_sqlite_dataset(old, new_rows, version, size):
+    #the new rows get the old dictionaries plus any new names, the rows in the file keep their names
+    old_rows = pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in old.queries.match_types.items()})
+    new_rows = align_dictionaries(old_rows, new_rows)[1]
+    home, away, current = rate_games(new_rows, old.ratings.current)
+    new_long = build_long_table(new_rows, first_match=old.games)
+    history = old.queries.latest_games(sorted(set(new_long['team'].astype(object))), FORM_GAMES - 1)
+    trends, summary = extend_trends(old.summary, history, new_long, FORM_GAMES)
+    new_long = with_trends(new_long, trends, Ratings(home, away, current), old.games)
+    path = write_database(QUERY_DB_DIR, version, new_rows, new_long, old.games, old.queries.path)
+    queries = SqliteQueries(path, new_long.dtypes, new_rows.dtypes)
+    return Dataset(version, size, new_rows, queries, extend_stats_cube(old.stats, new_long),
+                   Ratings(None, None, current), summary, old)
+
+
+#import the data into the script, this converts the date to datetime and creates a new column showing just the year
+#the fingerprint of the csv is used as the data version, anything cached against older data is thrown away
+data = build_dataset(*load_results(RESULTS_CSV, RESULTS_CACHE_DIR))
+
+#the dataset a request should use, it is fixed at the start of the request so a reload part way through
+#does not mix old and new data. Outside of a request (for example in a script) it is simply the latest one
+def current_data():
+    if flask.has_request_context():
+        if 'data' not in flask.g:
+            flask.g.data = data
+        return flask.g.data
+    return data
+
+#the callbacks read their rows through these, from the dataset the request started with
+#tournaments are the names picked in the tournament filter, none picked means every tournament
+#this returns the games for a team in a year as a dataframe
+def team_year_rows(team, year, venue, tournaments=None):
+    return current_data().queries.team_year_rows(team, year, venue, tournaments)
+
+#this returns every game a team has played, from 1872 onwards
+def team_rows(team, tournaments=None):
+    return current_data().queries.team_rows(team, 'All', tournaments)
+
+#the same for only its home or away games
+def team_venue_rows(team, venue, tournaments=None):
+    return current_data().queries.team_rows(team, venue, tournaments)
+
+#this returns the games between two teams from the first team's point of view, in date order
+#along with a summary of the results
+def head_to_head(team, opponent, venue, tournaments=None):
+    return current_data().queries.head_to_head(team, opponent, venue, tournaments)
+
+#this returns a team's rating after each of its games since 1872, with their dates and opponents
+#the ratings are worked out when the data is loaded and kept with the games, whichever backend they come from
+def team_ratings(team):
+    return team_rows(team)[['date', 'opponent', 'rating']]
+
+#the tournament filter's value as the functions above and the caches want it, sorted so the order they were
+#picked in does not matter
+def selected_tournaments(value):
+    return tuple(sorted(value or ()))
+
+#what goes on the end of a title when the charts only show some tournaments
+def tournament_note(tournaments):
+    if not tournaments:
+        return ''
+    if len(tournaments) <= 2:
+        return ' ({})'.format(' and '.join(tournaments))
+    return ' ({} tournaments)'.format(len(tournaments))
+
+
+#new results can be picked up without restarting: either by posting to /admin/reload (with the ADMIN_TOKEN
+#in an X-Admin-Token header) or by setting RELOAD_INTERVAL, the number of seconds between checks of the csv
+#only the rows added to the end of the csv are parsed, and only the indexes they touch are extended
+#if the csv was changed anywhere else, or the new games are dated before ones we have, everything is rebuilt
+#note that each gunicorn worker holds its own copy, the admin route only reloads the worker that answers it,
+#RELOAD_INTERVAL has every worker check for itself
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+RELOAD_INTERVAL = float(os.environ.get('RELOAD_INTERVAL', 0))
+
+reload_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+def reload_data():
+    global data
+    with reload_lock:
+        start = time.perf_counter()
+        old = data
+        appended = load_appended(RESULTS_CSV, old.size, old.version)
+        if appended is not None and appended[1] == old.version:
+            return {'mode': 'unchanged', 'version': old.version, 'rows': old.games, 'added': 0}
+        #with sqlite the new games are added to a copy of the old file, which another worker may have removed
+        #if this one has not reloaded for a long time
+        extendable = QUERY_BACKEND == 'pandas' or os.path.exists(old.queries.path)
+        if extendable and appended is not None and (len(appended[0]) == 0 or appended[0]['date'].min() >= old.last_date):
+            new_rows, version, size = appended
+            new = extend_dataset(old, new_rows, version, size)
+            mode = 'incremental'
+        else:
+            new = build_dataset(*load_results(RESULTS_CSV, RESULTS_CACHE_DIR))
+            mode = 'full'
+        #this one assignment is the swap, requests that already started keep the dataset they began with
+        data = new
+        if RESULTS_CACHE_DIR is not None and mode == 'incremental' and QUERY_BACKEND == 'pandas':
+            #keep the binary cache and the ratings up to date so workers that start later do not parse the csv
+            #or rate every game again. With sqlite the worker does not have the rows to write, so the next worker to
+            #start parses the csv and writes them once
+            store_results(new.queries.df_raw, RESULTS_CACHE_DIR, new.version)
+            save_ratings(RESULTS_CACHE_DIR, new.version, new.ratings)
+        summary = {'mode': mode, 'version': new.version, 'rows': new.games,
+                   'added': new.games - old.games, 'seconds': round(time.perf_counter() - start, 3)}
+        logger.info('reloaded results: %s', summary)
+        #the figures of the new version are filed under its own keys, so the popular views are built again
+        start_warmup()
+        return summary
+
+@server.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    #compare_digest takes as long whatever the token sent, so its time does not give away how much of it was right
+    token = flask.request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        flask.abort(403)
+    return flask.jsonify(reload_data())
+
+#checks the csv every RELOAD_INTERVAL seconds and reloads it if its size or modified time changed
+def watch_results():
+    last_seen = None
+    while True:
+        try:
+            stat = os.stat(RESULTS_CSV)
+            seen = (stat.st_size, stat.st_mtime)
+            if last_seen is not None and seen != last_seen:
+                reload_data()
+            last_seen = seen
+        except Exception:
+            logger.exception('checking %s for new results failed', RESULTS_CSV)
+        time.sleep(RELOAD_INTERVAL)
+
+#threads do not survive gunicorn forking its workers, so each worker starts its watcher and its warm up
+#on its first request
+worker_pid = None
+
+def start_background():
+    global worker_pid
+    if worker_pid == os.getpid():
+        return
+    worker_pid = os.getpid()
+    if RELOAD_INTERVAL > 0:
+        threading.Thread(target=watch_results, name='results-watcher', daemon=True).start()
+    start_warmup()
+
+server.before_request(start_background)
+
+#behind each worker's figure cache there is a cache file every worker on the machine shares, so a view one worker
+#has built is not built again by the others. It lives in the results cache folder unless SHARED_CACHE_PATH says
+#otherwise, and is kept under SHARED_CACHE_MB. Setting SHARED_CACHE_PATH to an empty value turns it off
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH', os.path.join(RESULTS_CACHE_DIR, 'figures.sqlite')
+                                   if RESULTS_CACHE_DIR else '')
+shared_cache = SharedCache(SHARED_CACHE_PATH, max_bytes=int(float(os.environ.get('SHARED_CACHE_MB', 256)) * 1024 * 1024)) \
+    if SHARED_CACHE_PATH else None
+
+#rendered figures are kept in a small cache so popular views are only built once
+#the size can be changed with environment variables, setting either to 0 turns the cache off
+#the entries are filed under the data version and FIGURE_SETTINGS (set further down, once the settings are read),
+#so a worker never reads back a figure built from other data, other settings or older code
+#the shared cache outlives a deploy, so FIGURE_FORMAT is in the settings: bump it whenever a cached function
+#returns something different, for example another figure, so the entries of older code are not read back
+FIGURE_FORMAT = 2
+figure_cache = FigureCache(
+    max_entries=int(os.environ.get('FIGURE_CACHE_ENTRIES', 256)),
+    max_bytes=int(float(os.environ.get('FIGURE_CACHE_MB', 64)) * 1024 * 1024),
+    version=lambda: '{}-{}'.format(current_data().version, FIGURE_SETTINGS),
+    shared=shared_cache)
+
+#every callback is timed, the timings go out in a Server-Timing header and are totalled up on /metrics
+#if SLOW_CALLBACK_MS is set, any callback request slower than that is logged along with its inputs
+metrics = Metrics(slow_ms=float(os.environ['SLOW_CALLBACK_MS']) if os.environ.get('SLOW_CALLBACK_MS') else None)
+metrics.install(server)
+
+#the figure cache and shared cache counters go on /metrics too
+def cache_metrics(prefix, cache):
+    return lambda: stats_lines(prefix, cache.stats(), ('entries', 'bytes'))
+
+metrics.add_collector(cache_metrics('figure_cache', figure_cache))
+if shared_cache is not None:
+    metrics.add_collector(cache_metrics('shared_cache', shared_cache))
+
+#callback responses are compressed for browsers that accept it, COMPRESS_MIN_BYTES=0 compresses everything and an
+#empty value turns compression off. The figures are turned into json with orjson, which plotly uses by itself when
+#it is installed (it is in requirements.txt)
+if os.environ.get('COMPRESS_MIN_BYTES', '1024'):
+    Compression(min_bytes=int(os.environ.get('COMPRESS_MIN_BYTES', '1024')),
+                level=int(os.environ.get('COMPRESS_LEVEL', 5))).install(server)
+
+#with FIGURE_PATCH set the callbacks send the charts' data and the few layout values that change, the rest of the
+#layout is sent once with the page. It needs a version of dash with Patch
+FIGURE_PATCH = os.environ.get('FIGURE_PATCH', '').lower() in ('1', 'true', 'yes') and hasattr(dash, 'Patch')
+
+#hovering is handled in the browser if CLIENTSIDE_HOVER is set, otherwise every chart is drawn on the server
+CLIENTSIDE_HOVER = os.environ.get('CLIENTSIDE_HOVER', '').lower() in ('1', 'true', 'yes')
+
+#this is what the callbacks send for a figure, all of it or only the parts that change
+def send_figure(figure, paths):
+    if not FIGURE_PATCH or figure is dash.no_update:
+        return figure
+    return figure_patch(dash.Patch(), figure, paths)
+
+#the match table shows these columns from the original data, with nicer names
+TABLE_COLUMNS = {'date': 'Date', 'home_team': 'Home Team', 'away_team': 'Away Team', 'tournament': 'Tournament',
+                 'city': 'City', 'country': 'Country', 'home_score': 'Home Score', 'away_score': 'Away Score'}
+
+#rows per page in the table, the most rows the table will show in one page, the most rows it will sort or filter,
+#and how many rows go into each chunk of a csv download
+TABLE_PAGE_SIZE = int(os.environ.get('TABLE_PAGE_SIZE', 15))
+TABLE_MAX_PAGE_SIZE = int(os.environ.get('TABLE_MAX_PAGE_SIZE', 100))
+TABLE_ROW_CAP = int(os.environ.get('TABLE_ROW_CAP', 5000))
+EXPORT_CHUNK_ROWS = 1000
+
+#the time series can show the selected year or every year since 1872, and the head to head always covers every year
+#a chart never gets more than SERIES_MAX_POINTS points for the dates it shows, longer histories are downsampled
+#zooming in on a chart asks the server for the points in the new range, so the detail comes back as we zoom
+#in clientside hover mode the browser draws the selected year only, so there is no choice of span
+SERIES_SPANS = [('year', 'Selected year'), ('all', 'All years')]
+DEFAULT_SPAN = 'year'
+SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS', 300))
+
+#the columns of the year range ranking, and how many games a team needs in the range to be ranked
+RANKING_COLUMNS = {'team': 'Team', 'played': 'Played', 'wins': 'W', 'draws': 'D', 'losses': 'L',
+                   'goals_for': 'GF', 'goals_against': 'GA', 'net': 'Net', 'win_rate': 'Win %'}
+RANKING_MIN_GAMES = int(os.environ.get('RANKING_MIN_GAMES', 10))
+
+#every setting that changes what the cached functions return, this goes in the figure cache version
+FIGURE_SETTINGS = 'figures{}-form{}-points{}-pages{}-cap{}-ranking{}'.format(
+    FIGURE_FORMAT, FORM_GAMES, SERIES_MAX_POINTS, TABLE_MAX_PAGE_SIZE, TABLE_ROW_CAP, RANKING_MIN_GAMES)
+
+#the columns of the form ranking
+FORM_COLUMNS = {'team': 'Team', 'last_game': 'Last Game', 'form': 'Net Goals per Game', 'points': 'Points per Game',
+                'trend': 'Trend'}
 
-#this adds a column with a random value
-df['random'] = np.random.uniform(0.03,0,len(df))
+#this will be the list of indicators that are available to select in drop downs
+available_indicators_homeaway = ['Home', 'Away', 'All']
 
-#this copies the original columns
-df['home_score1'] = df['home_score']
-df['away_score1'] = df['away_score']
+#this gives information about more visual layouts like the hovermode and the title
+#the hovermode is basically the datapoint for what we are hovering over
+#diagonal is where the win/loss line ends
+def scatter_layout(xaxis_column_name, title, diagonal):
+    return go.Layout(
+        xaxis={
+            'title': xaxis_column_name,
+            'hoverformat' : '.0f'
+        },
+        yaxis={
+            'title': 'Opponent',
+            'hoverformat' : '.0f'
+        },
+        margin={'l': 40, 'b': 30, 't': 10, 'r': 0},
+        height=450,
+        hovermode='closest',
+        annotations =    [{ 'x': 0, 'y': 0.95, 'xanchor': 'left', 'yanchor': 'bottom',
+                        'xref': 'paper', 'yref': 'paper', 'showarrow': False,
+                        'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
+                        'text': title }],
+        shapes = [{
+        'type': 'line',
+        'x0': 0,
+        'y0': 0,
+        'x1': diagonal,
+        'y1': diagonal,
+        'line': {
+            'color': 'rgb(180, 180, 180)',
+            'width': 4,
+            'dash': 'dashdot',
+        },
+    }]
+    )
+
+#the time series and the head to head share this layout, only the title and the dates shown change
+#zoom is the first and last date to show, when it is not given the chart fits all of its points
+def small_chart_layout(title, zoom=None):
+    return {
+        'xaxis': {'range': [str(zoom[0]), str(zoom[1])]} if zoom else {'autorange': True},
+        'height': 225,
+        'margin': {'l': 20, 'b': 30, 'r': 10, 't': 10},
+        'annotations': [{
+            'x': 0, 'y': 0.85, 'xanchor': 'left', 'yanchor': 'bottom',
+            'xref': 'paper', 'yref': 'paper', 'showarrow': False,
+            'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
+            'text': title
+        }]
+    }
 
-#this changes the existing columns and adds the value in the random column this basically means
-#if there are two of the same score, they both appear and they do not overlap
-#this fixes a previous problem where we could not see scores if they were duplicated
-df['home_score'] = df['home_score'] + df['random']
-df['away_score'] = df['away_score'] + df['random']
+#in data only mode (FIGURE_PATCH) the graphs start with these layouts in the page, and the callbacks only send
+#the traces and the layout values listed here
+SCATTER_PATCH_PATHS = [['xaxis', 'title'], ['annotations', 0, 'text'], ['shapes', 0, 'x1'], ['shapes', 0, 'y1']]
+SMALL_CHART_PATCH_PATHS = [['annotations', 0, 'text'], ['xaxis']]
 
-#this will be the list of indicators that are available to select in drop downs
-available_indicators_teams = np.sort(df['home_team'].unique())
-available_indicators_homeaway = ['Home', 'Away', 'All']
-available_indicators_tourny = np.sort(df['tournament'].unique())
+def static_figures():
+    return {
+        'result_scatter': {'data': [], 'layout': scatter_layout('', '', 0)},
+        'x-time-series': {'data': [], 'layout': small_chart_layout('')},
+        'y-time-series': {'data': [], 'layout': small_chart_layout('')},
+        'head-to-head': {'data': [], 'layout': small_chart_layout('')},
+        'rating-history': {'data': [], 'layout': small_chart_layout('')},
+    }
 
 #in here we start to define the outline of our app and get it define how it looks
 #the order that it is in is how it will appear
 #for example if the slider is above the dropdown it will appear above
-app.layout = html.Div([
+#it is a function so that every page load gets the teams and years of the latest data
+def serve_layout():
+    dataset = current_data()
+    available_indicators_teams = dataset.teams
+    figures = static_figures() if FIGURE_PATCH else {}
+    return html.Div([
         html.Div([
             #adding a dropdown which we give an id and ask it to use the options we defined above. The 'value' is simply its starting value when you open the app.
             html.Div([
                 dcc.Dropdown(
                     id='xaxis-column',
                     options=[{'label': i, 'value': i} for i in available_indicators_teams],
-                    value='England'
+                    value=DEFAULT_TEAM
                 ),
             ],
             #define its width and basic properties of how it looks
@@ -65,10 +642,22 @@ app.layout = html.Div([
                 dcc.Dropdown(
                     id='yaxis-column',
                     options=[{'label': i, 'value': i} for i in available_indicators_homeaway],
-                    value='All'
+                    value=DEFAULT_VENUE
+                ),
+            ],
+            style={'width': '23%', 'float': 'right', 'display': 'inline-block'}),
+
+            #every chart and the table can be cut down to some tournaments, picking none shows them all
+            html.Div([
+                dcc.Dropdown(
+                    id='tournament-filter',
+                    options=[{'label': i, 'value': i} for i in dataset.tournaments],
+                    value=[],
+                    multi=True,
+                    placeholder='All tournaments'
                 ),
             ],
-            style={'width': '23%', 'float': 'right', 'display': 'inline-block'})
+            style={'width': '100%', 'display': 'inline-block', 'paddingTop': '5px'})
            #this style piece is assigning values for both dropdown lists, changing the colour to make it stand out,
         ], style={
             'borderBottom': 'thin lightgrey solid',
@@ -78,102 +667,129 @@ app.layout = html.Div([
         #adding a slider as a nicer way to change the year we look at. We define some details here using the year column we created earlier.
         html.Div(dcc.Slider(
             id='year',
-            min=df['year'].min(),
-            max=df['year'].max(),
-            value=df['year'].max(),
+            min=dataset.years.min(),
+            max=dataset.years.max(),
+            value=dataset.years.max(),
             step=None,
-            marks={str(year): str(year) for year in df['year'].unique()}
+            marks={str(year): str(year) for year in dataset.years}
         ), style={'width': '98%', 'padding': '0px 20px 20px 20px'}),
 
         #this is the main chart that will show the scores
         html.Div([
             dcc.Graph(
             id='result_scatter',
-            hoverData={'points': [{'customdata':'France'}]}
+            hoverData={'points': [{'customdata': DEFAULT_COUNTRY}]},
+            **({'figure': figures['result_scatter']} if figures else {})
             )
         ], style={'width': '49%', 'display': 'inline-block', 'padding': '0 20'}),
         #these charts will be on the side and there is two, they will show timeseries dataa
-        html.Div([
-            dcc.Graph(id='x-time-series'),
-            dcc.Graph(id='y-time-series'),
+        html.Div(([] if CLIENTSIDE_HOVER else [dcc.RadioItems(
+                id='series-span',
+                options=[{'label': label, 'value': value} for value, label in SERIES_SPANS],
+                value=DEFAULT_SPAN,
+                labelStyle={'display': 'inline-block', 'padding': '0px 5px'}
+            )]) + [
+            dcc.Graph(id='x-time-series', **({'figure': figures['x-time-series']} if figures else {})),
+            dcc.Graph(id='y-time-series', **({'figure': figures['y-time-series']} if figures else {})),
         ], style={'display': 'inline-block', 'width': '49%'}),
         #this is for a table below the data that will additional information
+        #only the page of rows that is on screen is sent, sorting and filtering happen on the server
+        html.Div([
+            html.Div(id='table-title', style={'padding': '10px 5px'}),
+            html.A('Download all as CSV', id='table-export', href='', style={'padding': '0px 5px'}),
+            dash_table.DataTable(
+                id='table-data',
+                columns=[{'name': name, 'id': name, 'type': 'numeric' if name.endswith('Score') else 'text'}
+                         for name in TABLE_COLUMNS.values()],
+                page_current=0,
+                page_size=TABLE_PAGE_SIZE,
+                page_action='custom',
+                sort_action='custom',
+                sort_mode='single',
+                sort_by=[],
+                filter_action='custom',
+                filter_query='',
+                style_cell={'fontSize': 11, 'textAlign': 'left'},
+            ),
+        ], style={'display': 'inline-block', 'width': '98%'}),
+        #this will show head to head information, and below it the two teams' ratings over time
+        html.Div([
+            dcc.Graph(id='head-to-head', **({'figure': figures['head-to-head']} if figures else {})),
+            dcc.Graph(id='rating-history', **({'figure': figures['rating-history']} if figures else {})),
+        ], style={'display': 'inline-block', 'width': '98%'}),
+        #this is the year range view, it covers every year since 1872 and is worked out from the running totals
+        #so a range of decades costs the same as a single year
         html.Div([
-            dcc.Graph(id='table-data'),
+            html.Div(id='range-title', style={'padding': '10px 5px'}),
+            html.Div(dcc.RangeSlider(
+                id='year-range',
+                min=dataset.stats.first_year,
+                max=dataset.stats.last_year,
+                value=[FIRST_YEAR, dataset.stats.last_year],
+                step=1,
+                marks={str(year): str(year) for year in range(dataset.stats.first_year - dataset.stats.first_year % 10 + 10,
+                                                              dataset.stats.last_year + 1, 10)}
+            ), style={'padding': '0px 20px 20px 20px'}),
+            dcc.Graph(id='range-summary'),
+            dash_table.DataTable(
+                id='range-ranking',
+                columns=[{'name': name, 'id': name, 'type': 'text' if name == 'Team' else 'numeric'}
+                         for name in RANKING_COLUMNS.values()],
+                page_action='native',
+                page_size=10,
+                sort_action='native',
+                style_cell={'fontSize': 11, 'textAlign': 'left'},
+            ),
         ], style={'display': 'inline-block', 'width': '98%'}),
-        #this will show head to head information
+        #every team's form over its last games, it only changes with the data so it is sent with the page
         html.Div([
-            dcc.Graph(id='head-to-head'),
-        ], style={'display': 'inline-block', 'width': '98%'})
+            html.Div('Form over each team\'s last {} games, at every venue and in every tournament. Trend is the '
+                     'change in net goals per game of the line that best fits those games'.format(FORM_GAMES),
+                     style={'padding': '10px 5px'}),
+            dash_table.DataTable(
+                id='form-ranking',
+                columns=[{'name': name, 'id': name, 'type': 'text' if column in ('team', 'last_game') else 'numeric'}
+                         for column, name in FORM_COLUMNS.items()],
+                data=dataset.form_ranking[list(FORM_COLUMNS)].rename(FORM_COLUMNS, axis=1).to_dict('records'),
+                page_action='native',
+                page_size=10,
+                sort_action='native',
+                style_cell={'fontSize': 11, 'textAlign': 'left'},
+            ),
+        ], style={'display': 'inline-block', 'width': '98%'}),
+        #in clientside hover mode this holds the selected team's games, the hover charts are drawn from it in the browser
+        dcc.Store(id='team-bundle')
 ])
-#this defines what we want to update (main chart) and what data will update it
-@app.callback(
-    dash.dependencies.Output('result_scatter', 'figure'),
-    [dash.dependencies.Input('xaxis-column', 'value'),
-     dash.dependencies.Input('yaxis-column', 'value'),
-     dash.dependencies.Input('year', 'value')])
-#this function will provide the informat to update the graph
-def update_graph(xaxis_column_name, yaxis_column_name,
-                 year_value):
-    #ensures that the year we are showing matches the year we select
-    dff = df[df['year'] == year_value]
-    #loop to ascertain whether we are looking at Home or Away data. it assigns values accordingly
-    while True:
-        if yaxis_column_name == 'Home':
-            goal1 = dff[dff['home_team'] == xaxis_column_name]['home_score']
-            goal2 = dff.loc[dff['home_team'] == xaxis_column_name, 'away_score']
-            name = dff[dff['home_team'] == xaxis_column_name]['away_team']
-            custom = dff[dff['home_team'] == xaxis_column_name]['away_team']
-
-            #this will help us create a dynamic diagonal line which will indicate win vs loss
-            dff_g1 = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff_g2 = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff_goals = dff_g1.append(dff_g2, ignore_index=True)
-            max_goals_amt = dff_goals[['home_score','away_score']].max(axis=1)
-            break
-
-        elif yaxis_column_name == 'All':
-            #making two lists of where the selected team is in away or home, and then appending
-            dff_1 = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff_2 = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff = dff_1.append(dff_2, ignore_index=True)
-
-            #making the goals match where the selected team is for home and away, and appending the lists
-            goal1 = dff[dff['home_team'] == xaxis_column_name]['home_score'].append(dff[dff['away_team'] == xaxis_column_name]['away_score'], ignore_index=True)
-            goal2 = dff.loc[dff['home_team'] == xaxis_column_name, 'away_score'].append(dff.loc[dff['away_team'] == xaxis_column_name, 'home_score'], ignore_index=True)
-
-            #to get the right name we have to do a a few things
-            #first we are removing values where it equals the xaxis_column_name
-            dff1 = dff[~dff[['home_team', 'away_team']].isin([xaxis_column_name])]
-
-            #then we get all non-null values from both cols (data we want)
-            home_null = dff1.loc[dff1['home_team'].notnull(), ['home_team']]
-            away_null = dff1.loc[dff1['away_team'].notnull(), ['away_team']]
-
-            #we then append to each other and fill the na values, custom is the same as name
-            non_null = away_null.append(home_null, ignore_index = True)
-            name = non_null['home_team'].fillna(non_null['away_team'])
-            custom = name
-
-            #this will help us create a dynamic diagonal line which will indicate win vs loss
-            max_goals_amt = dff[['home_score','away_score']].max(axis=1)
-            break
-        else:
-            goal1 = dff[dff['away_team'] == xaxis_column_name]['away_score']
-            goal2 = dff.loc[dff['away_team'] == xaxis_column_name, 'home_score']
-            name = dff[dff['away_team'] == xaxis_column_name]['home_team']
-            custom = dff[dff['away_team'] == xaxis_column_name]['home_team']
-
-            #this will help us create a dynamic diagonal line which will indicate win vs loss
-            dff_g1 = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff_g2 = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff_goals = dff_g1.append(dff_g2, ignore_index=True)
-            max_goals_amt = dff_goals[['home_score','away_score']].max(axis=1)
-            break
 
-
-
-    title_1 = '<b>Score Matrix showing {} games for {}</b><br> Change the dropdown\'s above to modify the data shown'.format(yaxis_column_name, xaxis_column_name)
+app.layout = serve_layout
+
+#this groups a team's games by scoreline, with how many there were, the opponents in date order and the latest one
+#dff is in date order so 'last' is the most recent game
+#the opponents are grouped as names, otherwise pandas turns the joined names back into the team codes
+def scoreline_groups(dff):
+    grouped = dff['opponent'].astype(object).groupby([dff['goals_for'], dff['goals_against']], sort=True)
+    scores = grouped.agg(['size', 'last']).rename(columns={'size': 'games', 'last': 'latest'})
+    scores['opponents'] = grouped.agg(', '.join)
+    return scores.reset_index()
+
+#this function builds the main chart that shows the scores
+#dff is the selected team's games for the year, dff_all is all of them whatever the venue, which is used for the diagonal
+def create_scatter(dff, dff_all, xaxis_column_name, yaxis_column_name, note=''):
+    #the long table already has the goals from the selected team's point of view
+    #games with the same score would sit on top of each other, so each scoreline is drawn once
+    #the marker gets bigger with the number of games and the hover lists every opponent
+    scores = scoreline_groups(dff)
+    goal1 = scores['goals_for']
+    goal2 = scores['goals_against']
+    name = scores['games'].astype(str) + np.where(scores['games'] == 1, ' game: ', ' games: ') + scores['opponents']
+    #hovering picks the most recent opponent with that score for the charts below
+    custom = scores['latest']
+
+    #this will help us create a dynamic diagonal line which will indicate win vs loss
+    #it always covers all of the team's games that year so the line does not jump around when changing Home/Away
+    max_goals_amt = dff_all[['goals_for', 'goals_against']].max(axis=1)
+
+    title_1 = '<b>Score Matrix showing {} games for {}{}</b><br> Change the dropdown\'s above to modify the data shown'.format(yaxis_column_name, xaxis_column_name, note)
     #here, the return will return the plot we are looking for
     return {
         'data': [go.Scatter(
@@ -182,193 +798,82 @@ def update_graph(xaxis_column_name, yaxis_column_name,
             text=name,
             customdata=custom,
             mode='markers',
+            hoverinfo='x+y+text',
             marker=dict(
-                size = 15,
-                opacity = 0.5,
+                size = 12 + 6 * (np.sqrt(scores['games']) - 1),
+                opacity = 0.7,
                 color = goal2 - goal1,
                 line = dict(width = 0.5, color = 'black'
                 )
             )
         )],
-        #this gives information about more visual layouts like the hovermode and the title
-        #the hovermode is basically the datapoint for what we are hovering over
-        'layout': go.Layout(
-            xaxis={
-                'title': xaxis_column_name,
-                'hoverformat' : '.0f'
-            },
-            yaxis={
-                'title': 'Opponent',
-                'hoverformat' : '.0f'
-            },
-            margin={'l': 40, 'b': 30, 't': 10, 'r': 0},
-            height=450,
-            hovermode='closest',
-            annotations =    [{ 'x': 0, 'y': 0.95, 'xanchor': 'left', 'yanchor': 'bottom',
-                            'xref': 'paper', 'yref': 'paper', 'showarrow': False,
-                            'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
-                            'text': title_1 }],
-            shapes = [{
-            'type': 'line',
-            'x0': 0,
-            'y0': 0,
-            'x1': max_goals_amt.max(),
-            'y1': max_goals_amt.max(),
-            'line': {
-                'color': 'rgb(180, 180, 180)',
-                'width': 4,
-                'dash': 'dashdot',
-            },
-        }]
-
-        )
+        'layout': scatter_layout(xaxis_column_name, title_1, max_goals_amt.max())
     }
-#this function creates one of the timeseries graphs
-def create_time_series_x(dff, dff_two, title, yaxis_column_name, xaxis_column_name, country_name):
-    #loop to ascertain whether we are looking at Home or Away data. it assigns values accordingly
-    while True:
-        if yaxis_column_name == 'Home':
-            goal1 = dff_two[dff_two['home_team'] == country_name]['home_score']
-            goal2 = dff_two.loc[dff_two['home_team'] == country_name, 'away_score']
-            name = dff_two[dff_two['home_team'] == country_name]['away_team']
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-
-        elif yaxis_column_name == 'All':
-            #making two lists of where the selected team is in away or home, and then appending
-            dff_1 = dff_two[dff_two['home_team'].isin([country_name])]
-            dff_2 = dff_two[dff_two['away_team'].isin([country_name])]
-            dff = dff_1.append(dff_2, ignore_index=True)
-            dff = dff.sort_values('date')
-
-            #making the goals match where the selected team is for home and away, and appending the lists
-            goal1 = dff[dff['home_team'] == country_name][['home_score','date']].append(dff[dff['away_team'] == country_name][['away_score','date']], ignore_index=True)
-            goal2 = dff.loc[dff['home_team'] == country_name, ('away_score','date')].append(dff.loc[dff['away_team'] == country_name, ('home_score','date')], ignore_index=True)
-
-            #sortig the values by date
-            goal1 = goal1.sort_values('date')
-            goal2 = goal2.sort_values('date')
-
-            #filling na's to make it into a series
-            goal1 = goal1['away_score'].fillna(goal1['home_score'])
-            goal2 = goal2['away_score'].fillna(goal2['home_score'])
-
-            #to get the right name we have to do a a few things
-            #first we are removing values where it equals the xaxis_column_name
-            dff1 = dff[~dff[['home_team', 'away_team', 'date']].isin([country_name])]
-
-            #then we get all non-null values from both cols (data we want)
-            home_null = dff1.loc[dff1['home_team'].notnull(), ('home_team','date')]
-            away_null = dff1.loc[dff1['away_team'].notnull(), ('away_team','date')]
-
-            #we then append to each other and fill the na values, custom is the same as name
-            non_null = away_null.append(home_null, ignore_index = True)
-            non_null = non_null.sort_values('date')
-            name = non_null['home_team'].fillna(non_null['away_team'])
-
-            #goal net is obviously the net of the goals scores and the colour is based off this too
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-        else:
-            #this does a similiar thing as is shown above, but if the dropdown is set too away
-            goal1 = dff_two[dff_two['away_team'] == country_name]['away_score']
-            goal2 = dff_two.loc[dff_two['away_team'] == country_name, 'home_score']
-            name = dff_two[dff_two['away_team'] == country_name]['home_team']
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-    #this returns the graph we are looking for
+
+#this shows a team's wins, draws and losses for each year of the range, stacked on top of each other
+#dff has one row per year, from StatsCube.team_years
+def create_range_summary(dff, title):
     return {
-        'data': [go.Scatter(
-            x=dff['date'],
-            y=goal_net,
-            text=name,
-            mode='lines+markers',
-            marker=dict(
-                size = 8,
-                opacity = 0.9,
-                color = goal_colour,
-                line = dict(width = 0.5, color = 'black'
-                )
-            )
-        )],
-        'layout': {
-            'height': 225,
-            'margin': {'l': 20, 'b': 30, 'r': 10, 't': 10},
-            'annotations': [{
-                'x': 0, 'y': 0.85, 'xanchor': 'left', 'yanchor': 'bottom',
-                'xref': 'paper', 'yref': 'paper', 'showarrow': False,
-                'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
-                'text': title
-            }]
-        }
+        'data': [go.Bar(x=dff['year'], y=dff[name], name=label, marker={'color': colour})
+                 for name, label, colour in (('wins', 'Won', 'rgb(44, 160, 44)'), ('draws', 'Drawn', 'rgb(180, 180, 180)'),
+                                             ('losses', 'Lost', 'rgb(214, 39, 40)'))],
+        'layout': dict(small_chart_layout(title), barmode='stack', height=300,
+                       margin={'l': 30, 'b': 30, 'r': 10, 't': 40}, legend={'orientation': 'h', 'y': -0.15})
     }
-#this is the same as the above but for the other time series graph
-#it shows the same information but for th other team
-def create_time_series_y(dff, dff_two, title, yaxis_column_name, xaxis_column_name):
-    #loop to ascertain whether we are looking at Home or Away data. it assigns values accordingly
-    while True:
-        if yaxis_column_name == 'Home':
-            goal1 = dff_two[dff_two['home_team'] == xaxis_column_name]['home_score']
-            goal2 = dff_two.loc[dff_two['home_team'] == xaxis_column_name, 'away_score']
-            name = dff_two[dff_two['home_team'] == xaxis_column_name]['away_team']
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-
-        elif yaxis_column_name == 'All':
-            #making two lists of where the selected team is in away or home, and then appending
-            dff_1 = dff_two[dff_two['home_team'].isin([xaxis_column_name])]
-            dff_2 = dff_two[dff_two['away_team'].isin([xaxis_column_name])]
-            dff = dff_1.append(dff_2, ignore_index=True)
-            dff = dff.sort_values('date')
-
-            #making the goals match where the selected team is for home and away, and appending the lists
-            goal1 = dff[dff['home_team'] == xaxis_column_name][['home_score','date']].append(dff[dff['away_team'] == xaxis_column_name][['away_score','date']], ignore_index=True)
-            goal2 = dff.loc[dff['home_team'] == xaxis_column_name, ('away_score','date')].append(dff.loc[dff['away_team'] == xaxis_column_name, ('home_score','date')], ignore_index=True)
-
-            #sortig the values by date
-            goal1 = goal1.sort_values('date')
-            goal2 = goal2.sort_values('date')
-
-            #filling na's to make it into a series
-            goal1 = goal1['away_score'].fillna(goal1['home_score'])
-            goal2 = goal2['away_score'].fillna(goal2['home_score'])
-
-            #to get the right name we have to do a a few things
-            #first we are removing values where it equals the xaxis_column_name
-            dff1 = dff[~dff[['home_team', 'away_team', 'date']].isin([xaxis_column_name])]
-
-            #then we get all non-null values from both cols (data we want)
-            home_null = dff1.loc[dff1['home_team'].notnull(), ('home_team','date')]
-            away_null = dff1.loc[dff1['away_team'].notnull(), ('away_team','date')]
-
-            #we then append to each other and fill the na values, custom is the same as name
-            non_null = away_null.append(home_null, ignore_index = True)
-            non_null = non_null.sort_values('date')
-            name = non_null['home_team'].fillna(non_null['away_team'])
-
-            #net goals and the same is used for the colour
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
 
+#the games a time series or head to head chart draws, dff is in date order
+#with a zoom only the games in that range are kept, plus one either side so the line runs off the edges,
+#then if there are more than SERIES_MAX_POINTS the ones that best keep the shape of the line are picked
+#the title says when some of the games are left out
+#the points are picked to keep the shape of the net goals, or of the column given
+def visible_points(dff, title, zoom, column=None):
+    dates = dff['date'].to_numpy()
+    if zoom is not None:
+        start = max(np.searchsorted(dates, zoom[0].to_datetime64(), side='left') - 1, 0)
+        stop = min(np.searchsorted(dates, zoom[1].to_datetime64(), side='right') + 1, len(dff))
+        dff, dates = dff.iloc[start:stop], dates[start:stop]
+    if len(dff) > SERIES_MAX_POINTS:
+        if column is None:
+            values = dff['goals_for'].to_numpy().astype(np.int64) - dff['goals_against'].to_numpy()
         else:
-            #this does a similiar thing as the above but if the dropdown is set to away
-            goal1 = dff_two[dff_two['away_team'] == xaxis_column_name]['away_score']
-            goal2 = dff_two.loc[dff_two['away_team'] == xaxis_column_name, 'home_score']
-            name = dff_two[dff_two['away_team'] == xaxis_column_name]['home_team']
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-    #this returns the grah we are looking for
+            values = dff[column].to_numpy()
+        points = dff.iloc[lttb(dates.astype('datetime64[s]').astype(np.int64), values, SERIES_MAX_POINTS)]
+        title += ' (showing {} of {} games)'.format(len(points), len(dff))
+        dff = points
+    return dff, title
+
+#the dates a chart has been zoomed to, from its relayoutData, or None if it shows everything
+#plotly sends the range either as two keys or as one list, depending on how the zoom was done
+def zoom_range(relayout):
+    relayout = relayout or {}
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        values = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif len(relayout.get('xaxis.range') or []) == 2:
+        values = relayout['xaxis.range']
+    else:
+        return None
+    try:
+        start, end = (pd.Timestamp(value) for value in values)
+    except (TypeError, ValueError):
+        return None
+    return (start, end) if start < end else None
+
+#this function creates the timeseries graphs, it is used for both the selected team and the team we hover over
+#dff is a slice of the long table, so it is already from the right team's point of view and in date order
+#on top of the results it draws the team's form and trend at each game, which cover all of its games whatever
+#the venue and tournaments shown
+def create_time_series(dff, title, zoom=None):
+    dff, title = visible_points(dff, title, zoom)
+    #goal net is obviously the net of the goals scores and the colour is based off this too
+    goal_net = dff['goals_for'] - dff['goals_against']
+    goal_colour = -goal_net
+    form, trend = dff['form'].to_numpy(), dff['trend'].to_numpy()
+    #this returns the graph we are looking for
     return {
         'data': [go.Scatter(
             x=dff['date'],
             y=goal_net,
-            text=name,
+            text=dff['opponent'],
             mode='lines+markers',
             marker=dict(
                 size = 8,
@@ -377,71 +882,40 @@ def create_time_series_y(dff, dff_two, title, yaxis_column_name, xaxis_column_na
                 line = dict(width = 0.5, color = 'black'
                 )
             )
+        ),
+        go.Scatter(
+            x=dff['date'],
+            y=form.round(3),
+            name='Form (last {})'.format(FORM_GAMES),
+            mode='lines',
+            hoverinfo='y+name',
+            showlegend=False,
+            line=dict(width = 1.5, color = 'grey', dash = 'dot')
+        ),
+        go.Scatter(
+            x=dff['date'],
+            y=trend.round(3),
+            name='Trend',
+            mode='lines',
+            hoverinfo='y+name',
+            showlegend=False,
+            line=dict(width = 1.5, color = 'orange')
         )],
-        'layout': {
-            'height': 225,
-            'margin': {'l': 20, 'b': 30, 'r': 10, 't': 10},
-            'annotations': [{
-                'x': 0, 'y': 0.85, 'xanchor': 'left', 'yanchor': 'bottom',
-                'xref': 'paper', 'yref': 'paper', 'showarrow': False,
-                'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
-                'text': title
-            }]
-        }
+        'layout': small_chart_layout(title, zoom)
     }
 
-def create_hth(dff, xaxis_column_name, yaxis_column_name, title):
-    #loop to ascertain whether we are looking at Home or Away data. it assigns values accordingly
-
-    while True:
-        if yaxis_column_name == 'Home':
-            goal1 = dff[dff['home_team'] == xaxis_column_name]['home_score']
-            goal2 = dff.loc[dff['home_team'] == xaxis_column_name, 'away_score']
-            name = dff[dff['home_team'] == xaxis_column_name]['date']
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-
-        elif yaxis_column_name == 'All':
-            #making two lists of where the selected team is in away or home, and then appending
-            dff_1 = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff_2 = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff = dff_1.append(dff_2, ignore_index=True)
-            dff = dff.sort_values('date')
-
-            #making the goals match where the selected team is for home and away, and appending the lists
-            goal1 = dff[dff['home_team'] == xaxis_column_name][['home_score','date']].append(dff[dff['away_team'] == xaxis_column_name][['away_score','date']], ignore_index=True)
-            goal2 = dff.loc[dff['home_team'] == xaxis_column_name, ('away_score','date')].append(dff.loc[dff['away_team'] == xaxis_column_name, ('home_score','date')], ignore_index=True)
-
-            #sortig the values by date
-            goal1 = goal1.sort_values('date')
-            goal2 = goal2.sort_values('date')
-
-            #filling na's to make it into a series
-            goal1 = goal1['away_score'].fillna(goal1['home_score'])
-            goal2 = goal2['away_score'].fillna(goal2['home_score'])
-
-            name = dff['date']
-
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-
-        else:
-            goal1 = dff[dff['away_team'] == xaxis_column_name]['away_score']
-            goal2 = dff.loc[dff['away_team'] == xaxis_column_name, 'home_score']
-            name = dff[dff['away_team'] == xaxis_column_name]['date']
-            goal_net = goal1-goal2
-            goal_colour = goal2-goal1
-            break
-
+#dff here is the selected team's games against one opponent, from the selected team's point of view
+def create_hth(dff, title, zoom=None):
+    dff, title = visible_points(dff, title, zoom)
+    goal_net = dff['goals_for'] - dff['goals_against']
+    goal_colour = -goal_net
 
     #this returns the grah we are looking for
     return {
         'data': [go.Scatter(
             x=dff['date'],
             y=goal_net,
-            text=name,
+            text=dff['date'],
             mode='lines+markers',
             marker=dict(
                 size = 8,
@@ -451,160 +925,640 @@ def create_hth(dff, xaxis_column_name, yaxis_column_name, title):
                 )
             )
         )],
-        'layout': {
-            'height': 225,
-            'margin': {'l': 20, 'b': 30, 'r': 10, 't': 10},
-            'annotations': [{
-                'x': 0, 'y': 0.85, 'xanchor': 'left', 'yanchor': 'bottom',
-                'xref': 'paper', 'yref': 'paper', 'showarrow': False,
-                'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
-                'text': title
-            }]
-        }
+        'layout': small_chart_layout(title, zoom)
     }
 
+#lines is a list of (team, points, note) from rating_points, one line is drawn for each team
+def create_ratings(lines, title, zoom=None):
+    traces = []
+    for team, shown, note in lines:
+        traces.append(go.Scatter(
+            x=shown['date'],
+            y=shown['rating'].round(1),
+            text=shown['opponent'],
+            name=team,
+            mode='lines'
+        ))
+    if any(note for team, shown, note in lines):
+        title += ' (showing up to {} games a team)'.format(SERIES_MAX_POINTS)
+    return {
+        'data': traces,
+        'layout': small_chart_layout(title, zoom)
+    }
 
-#callback shows what we want to update and the data that will update it
-@app.callback(
-    dash.dependencies.Output('x-time-series', 'figure'),
-    [dash.dependencies.Input('result_scatter', 'hoverData'),
-     dash.dependencies.Input('year', 'value'),
-     dash.dependencies.Input('yaxis-column', 'value'),
-     dash.dependencies.Input('xaxis-column', 'value')])
-def update_y_timeseries(hoverData, year_value, yaxis_column_name, xaxis_column_name):
-    #this function will update one timeseries graph and feeds it the information to update
-
-    #filter by the year we are looking at
-    dff = df[df['year'] == year_value]
-    dff_two = df[df['year'] == year_value]
-
-    #filter by the country we are looking at
-    country_name = xaxis_column_name
-
-    #another loop to deal with Home vs Away
-    while True:
-        if yaxis_column_name == 'Home':
-            dff = dff[dff['home_team'] == country_name]
-            break
-        elif yaxis_column_name =='All':
-            dff_1 = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff_2 = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff = dff_1.append(dff_2, ignore_index=True)
-            dff = dff.sort_values('date')
-            break
+#the table gives more information about each game for the selected team
+#dff is a slice of the long table, we go back to the original rows so home and away show the way they were played
+def table_rows(dff):
+    dff = current_data().queries.match_rows(dff['match'].values)
+    #these are the columns we want to show, renamed to make them more appealing
+    dff = dff[list(TABLE_COLUMNS)].rename(TABLE_COLUMNS, axis=1)
+    dff['Date'] = dff['Date'].dt.strftime('%Y-%m-%d')
+    #the text columns are codes in memory, the table sorts and filters the names
+    for column in dff.select_dtypes('category').columns:
+        dff[column] = dff[column].astype(object)
+    return dff
+
+#the table filter sends queries like {Home Team} contains "Eng" && {Home Score} > 2
+#this splits one part of that into the column, the operator and the value
+#the operator is only looked for straight after the column, so one inside the value (the 'le' in "Isle of Man")
+#is part of the value. The longer symbols come first so '>=' is not read as '>'
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                    ['contains '], ['datestartswith ']]
+FILTER_PART = re.compile(r'^\s*\{(.+?)\}\s*(' + '|'.join(re.escape(operator) for operator_type in FILTER_OPERATORS
+                                                    for operator in operator_type) + r')\s*(.*?)\s*$', re.DOTALL)
+#word operators and symbol operators mean the same thing, we use the word from here on
+FILTER_WORDS = {operator: operator_type[0].strip() for operator_type in FILTER_OPERATORS for operator in operator_type}
+
+def split_filter_part(filter_part):
+    match = FILTER_PART.match(filter_part)
+    if match is None:
+        return None, None, None
+    name, operator, value_part = match.groups()
+    operator = FILTER_WORDS[operator]
+    if len(value_part) > 1 and value_part[0] == value_part[-1] and value_part[0] in ('"', "'", '`'):
+        value = value_part[1: -1].replace('\\' + value_part[0], value_part[0])
+    elif operator in ('contains', 'datestartswith'):
+        #these compare text, so 2018 stays 2018 rather than becoming 2018.0
+        value = value_part
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    return name, operator, value
+
+#this applies the table's filter and sort to the rows, anything we do not understand is ignored
+def filter_and_sort(dff, filter_query, sort_by):
+    for filter_part in (filter_query or '').split(' && '):
+        name, operator, value = split_filter_part(filter_part)
+        if name not in dff.columns:
+            continue
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            try:
+                dff = dff.loc[getattr(dff[name], operator)(value)]
+            except TypeError:
+                #for example comparing a team name with a number
+                continue
+        elif operator == 'contains':
+            dff = dff.loc[dff[name].astype(str).str.contains(str(value), case=False, regex=False)]
+        elif operator == 'datestartswith':
+            dff = dff.loc[dff[name].astype(str).str.startswith(str(value))]
+    if sort_by:
+        dff = dff.sort_values(sort_by[0]['column_id'], ascending=sort_by[0]['direction'] == 'asc', kind='mergesort')
+    return dff
+
+
+#a team's time series for the selected year, or for every year, zoomed in to a range of dates if zoom is given
+def series_figure(team, yaxis_column_name, year_value, span, tournaments, zoom=None):
+    with metrics.timed('filter'):
+        if span == 'all':
+            dff = team_venue_rows(team, yaxis_column_name, tournaments)
         else:
-            dff = dff[dff['away_team'] == country_name]
-            break
-    #giving it a nice adaptive title
-    title = '<b>{} {} Results in {}</b><br>Net Goals - Above Zero Equals a Win, Below Equals a Loss'.format(country_name, yaxis_column_name, year_value)
-    return create_time_series_y(dff, dff_two, title, yaxis_column_name, xaxis_column_name)
-
-
-#same as the other chart above, differences have been commented
-@app.callback(
-    dash.dependencies.Output('y-time-series', 'figure'),
-    [dash.dependencies.Input('result_scatter', 'hoverData'),
-     dash.dependencies.Input('year', 'value'),
-     dash.dependencies.Input('yaxis-column', 'value'),
-     dash.dependencies.Input('xaxis-column', 'value')])
-def update_x_timeseries(hoverData, year_value, yaxis_column_name, xaxis_column_name):
-    dff = df[df['year'] == year_value]
-    dff_two = df[df['year'] == year_value]
-    #difference here is that we use the hoverdata to select the information that is shown
-    #this means that as we move through the graph the info updates
+            dff = team_year_rows(team, year_value, yaxis_column_name, tournaments)
+
+    #giving the time series a nice adaptive title
+    title = '<b>{} {} Results in {}{}</b><br>Net Goals - Above Zero Equals a Win, Below Equals a Loss'.format(
+        team, yaxis_column_name, 'all years' if span == 'all' else year_value, tournament_note(tournaments))
+    with metrics.timed('figure'):
+        return create_time_series(dff, title, zoom)
+
+#the head to head between the selected team and the hovered country, zoomed in to a range of dates if zoom is given
+def hth_figure(xaxis_column_name, country_name, yaxis_column_name, tournaments, zoom=None):
+    with metrics.timed('filter'):
+        #look up the games between the selected team and the country we hover over, with a summary of the results
+        dff_hth, summary = head_to_head(xaxis_column_name, country_name, yaxis_column_name, tournaments)
+
+    title_hth = '<b>Graph shows {} head to head games for {} versus {}{}</b> ({played} played, {wins}W {draws}D {losses}L, net goals {net:+d})<br> Net Goals - A result above 0 shows a win for the user selected team'.format(yaxis_column_name, xaxis_column_name, country_name, tournament_note(tournaments), **summary)
+    with metrics.timed('figure'):
+        return create_hth(dff_hth, title_hth, zoom)
+
+#the ratings of the selected team and the hovered country since 1872, zoomed in to a range of dates if zoom is given
+#they come from the precomputed history so they do not change with the venue, the year or the tournaments
+def rating_figure(xaxis_column_name, country_name, zoom=None):
+    teams = [xaxis_column_name] if country_name == xaxis_column_name else [xaxis_column_name, country_name]
+    with metrics.timed('filter'):
+        lines = [(team,) + rating_points(team, zoom) for team in teams]
+
+    current = current_data().ratings.current
+    latest = ', '.join('{} {:.0f}'.format(team, current[team]) for team in teams if team in current)
+    title = '<b>Elo ratings of {}</b> (latest {})<br>The rating after every game since 1872, at every venue and in every tournament'.format(' and '.join(teams), latest)
+    with metrics.timed('figure'):
+        return create_ratings(lines, title, zoom)
+
+#the points of a team's rating history a chart draws, up to SERIES_MAX_POINTS for the dates shown, and the note
+#visible_points gives when some are left out. Unzoomed they only change with the data, so each team's are picked
+#once and kept with the dataset
+def rating_points(team, zoom):
+    if zoom is not None:
+        return visible_points(team_ratings(team), '', zoom, 'rating')
+    dataset = current_data()
+    points = dataset.rating_points.get(team)
+    if points is None:
+        points = dataset.rating_points[team] = visible_points(team_ratings(team), '', None, 'rating')
+    return points
+
+#the unzoomed ratings chart only depends on the two teams, so it is cached on its own and shared by every year and venue
+@figure_cache.memoize
+def comparison_figure(xaxis_column_name, country_name):
+    return rating_figure(xaxis_column_name, country_name)
+
+#these are the figures that only depend on the dropdowns, the year and the span: the scatter and the selected team's
+#time series
+@figure_cache.memoize
+def selection_figures(xaxis_column_name, yaxis_column_name, year_value, span, tournaments):
+    with metrics.timed('filter'):
+        dff = team_year_rows(xaxis_column_name, year_value, yaxis_column_name, tournaments)
+        dff_all = team_year_rows(xaxis_column_name, year_value, 'All', tournaments)
+
+    with metrics.timed('figure'):
+        scatter = create_scatter(dff, dff_all, xaxis_column_name, yaxis_column_name, tournament_note(tournaments))
+    return scatter, series_figure(xaxis_column_name, yaxis_column_name, year_value, span, tournaments)
+
+#these are the figures that change as we hover over the scatter: the hovered country's time series,
+#the head to head between the selected team and the hovered country and the two teams' ratings
+@figure_cache.memoize
+def hover_figures(xaxis_column_name, yaxis_column_name, year_value, country_name, span, tournaments):
+    return (series_figure(country_name, yaxis_column_name, year_value, span, tournaments),
+            hth_figure(xaxis_column_name, country_name, yaxis_column_name, tournaments),
+            comparison_figure(xaxis_column_name, country_name))
+
+#the charts that can be zoomed, in the order update_dashboard returns them after the scatter
+ZOOM_CHARTS = ['x-time-series', 'y-time-series', 'head-to-head', 'rating-history']
+
+
+#this one callback updates every chart on the page, so a change only costs one request
+#if all that changed is the country we hover over, the charts that do not depend on it are left as they are
+#if all that changed is the zoom of a time series or the head to head, only that chart is drawn again with the
+#points for the dates it now shows. Zoomed charts are not cached, there are too many ranges for that to help
+def update_dashboard(hoverData, year_value, yaxis_column_name, xaxis_column_name, tournament_value, span, *relayouts):
+    #we use the hoverdata to select the country for the hover charts, as we move through the graph the info updates
     country_name = hoverData['points'][0]['customdata']
+    span = span or DEFAULT_SPAN
+    tournaments = selected_tournaments(tournament_value)
+
+    triggered = set(trigger['prop_id'].split('.')[0] for trigger in dash.callback_context.triggered)
+    if triggered and triggered <= set(ZOOM_CHARTS):
+        figures = [dash.no_update] * len(ZOOM_CHARTS)
+        for position, (chart, relayout) in enumerate(zip(ZOOM_CHARTS, relayouts)):
+            #plotly also sends relayoutData when it resizes a chart, only a change to the dates shown counts
+            if chart not in triggered or not any(key.startswith('xaxis.') for key in relayout or {}):
+                continue
+            zoom = zoom_range(relayout)
+            if chart == 'head-to-head':
+                figures[position] = hth_figure(xaxis_column_name, country_name, yaxis_column_name, tournaments, zoom)
+            elif chart == 'rating-history':
+                figures[position] = rating_figure(xaxis_column_name, country_name, zoom)
+            else:
+                team = xaxis_column_name if chart == 'x-time-series' else country_name
+                figures[position] = series_figure(team, yaxis_column_name, year_value, span, tournaments, zoom)
+        return (dash.no_update,) + tuple(send_figure(figure, SMALL_CHART_PATCH_PATHS) for figure in figures)
+
+    if triggered == {'result_scatter'}:
+        scatter_figure = selected_series_figure = dash.no_update
+    else:
+        scatter_figure, selected_series_figure = selection_figures(xaxis_column_name, yaxis_column_name, year_value,
+                                                                   span, tournaments)
+
+    hover_series_figure, hover_hth_figure, hover_rating_figure = hover_figures(xaxis_column_name, yaxis_column_name,
+                                                                               year_value, country_name, span, tournaments)
+    return (send_figure(scatter_figure, SCATTER_PATCH_PATHS), send_figure(selected_series_figure, SMALL_CHART_PATCH_PATHS),
+            send_figure(hover_series_figure, SMALL_CHART_PATCH_PATHS), send_figure(hover_hth_figure, SMALL_CHART_PATCH_PATHS),
+            send_figure(hover_rating_figure, SMALL_CHART_PATCH_PATHS))
+
+
+#in clientside hover mode the server only sends the scatter and one bundle of data for the selected team and year
+#the bundle has every game the team has played (for the head to head) and every game that year for the team and
+#each of its opponents (for the two time series). The browser then draws the hover charts itself, see assets/clientside.js
+#the country being hovered over when the selection changes may not be an opponent, for example the one on the
+#landing page or one left over from another team, so its games that year are added too (extra_team, or None)
+#teams are sent as numbers that point into the 'teams' list, which keeps the bundle small
+#with a tournament filter the bundle only has the games in those tournaments
+@figure_cache.memoize
+def team_bundle(xaxis_column_name, year_value, tournaments, extra_team):
+    with metrics.timed('filter'):
+        history = team_rows(xaxis_column_name, tournaments)
+        season = team_year_rows(xaxis_column_name, year_value, 'All', tournaments)
+        others = list(season['opponent'].unique()) + ([extra_team] if extra_team is not None else [])
+        season = pd.concat([season] + [team_year_rows(name, year_value, 'All', tournaments) for name in others])
+    teams = sorted(set(history['opponent']) | set(season['team']) | set(season['opponent']) | {xaxis_column_name})
+
+    def columns(dff):
+        return {
+            'date': dff['date'].dt.strftime('%Y-%m-%d').tolist(),
+            'opponent': pd.Categorical(dff['opponent'], categories=teams).codes.tolist(),
+            'goals_for': dff['goals_for'].astype(int).tolist(),
+            'goals_against': dff['goals_against'].astype(int).tolist(),
+            'home': (dff['venue'].cat.codes == 0).astype(int).tolist(),
+        }
 
-    #filter dataframe based on the axis input
-    while True:
-        if yaxis_column_name == 'Home':
-            dff = dff[dff['home_team'] == country_name]
-            break
-        elif yaxis_column_name == 'All':
-            dff_1 = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff_2 = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff = dff_1.append(dff_2, ignore_index=True)
-            dff = dff.sort_values('date')
-            break
-        else:
-            dff = dff[dff['away_team'] == country_name]
-            break
-
-    title = '<b>{} {} Results in {}</b><br>Net Goals - Above Zero Equals a Win, Below Equals a Loss'.format(country_name,yaxis_column_name, year_value)
-    return create_time_series_x(dff, dff_two, title, yaxis_column_name, xaxis_column_name, country_name)
-
-
-@app.callback(
-    dash.dependencies.Output('head-to-head', 'figure'),
-    [dash.dependencies.Input('result_scatter', 'hoverData'),
-     dash.dependencies.Input('xaxis-column', 'value'),
-     dash.dependencies.Input('yaxis-column', 'value')])
-def update_hth_graph(hoverData, xaxis_column_name, yaxis_column_name):
-
+    with metrics.timed('figure'):
+        season_columns = columns(season)
+        season_columns['team'] = pd.Categorical(season['team'], categories=teams).codes.tolist()
+        season_columns['form'] = season['form'].round(3).tolist()
+        season_columns['trend'] = season['trend'].round(3).tolist()
+        history_columns = columns(history)
+    return {'team': xaxis_column_name, 'year': year_value, 'teams': teams, 'form_games': FORM_GAMES,
+            'history': history_columns, 'season': season_columns}
+
+#the bundle for a selection with a country hovered over, the country only counts as extra when it is not the team
+#or one of its opponents that year, so the usual case shares one cached bundle whatever is being hovered over
+def hover_bundle(xaxis_column_name, year_value, tournaments, country_name):
+    if country_name == xaxis_column_name or country_name in set(
+            team_year_rows(xaxis_column_name, year_value, 'All', tournaments)['opponent']):
+        country_name = None
+    return team_bundle(xaxis_column_name, year_value, tournaments, country_name)
+
+def update_selection(year_value, yaxis_column_name, xaxis_column_name, tournament_value, hoverData):
+    tournaments = selected_tournaments(tournament_value)
+    scatter_figure, _ = selection_figures(xaxis_column_name, yaxis_column_name, year_value, DEFAULT_SPAN, tournaments)
+    country_name = hoverData['points'][0]['customdata'] if hoverData else None
+    return (send_figure(scatter_figure, SCATTER_PATCH_PATHS),
+            hover_bundle(xaxis_column_name, year_value, tournaments, country_name))
+
+#the browser does not have the ratings, so in clientside hover mode the ratings chart still comes from the server
+#it is a slice of the precomputed history and the unzoomed chart is cached, so each hover is a quick lookup
+def update_ratings(hoverData, xaxis_column_name, relayout):
     country_name = hoverData['points'][0]['customdata']
+    triggered = set(trigger['prop_id'].split('.')[0] for trigger in dash.callback_context.triggered)
+    if triggered == {'rating-history'}:
+        if not any(key.startswith('xaxis.') for key in relayout or {}):
+            return dash.no_update
+        return send_figure(rating_figure(xaxis_column_name, country_name, zoom_range(relayout)), SMALL_CHART_PATCH_PATHS)
+    return send_figure(comparison_figure(xaxis_column_name, country_name), SMALL_CHART_PATCH_PATHS)
+
+
+if CLIENTSIDE_HOVER:
+    app.callback(
+        [dash.dependencies.Output('result_scatter', 'figure'),
+         dash.dependencies.Output('team-bundle', 'data')],
+        [dash.dependencies.Input('year', 'value'),
+         dash.dependencies.Input('yaxis-column', 'value'),
+         dash.dependencies.Input('xaxis-column', 'value'),
+         dash.dependencies.Input('tournament-filter', 'value')],
+        [dash.dependencies.State('result_scatter', 'hoverData')])(metrics.instrument('update_selection')(update_selection))
+    app.clientside_callback(
+        ClientsideFunction(namespace='football', function_name='hover_figures'),
+        [dash.dependencies.Output('x-time-series', 'figure'),
+         dash.dependencies.Output('y-time-series', 'figure'),
+         dash.dependencies.Output('head-to-head', 'figure')],
+        [dash.dependencies.Input('result_scatter', 'hoverData'),
+         dash.dependencies.Input('yaxis-column', 'value'),
+         dash.dependencies.Input('team-bundle', 'data')])
+    app.callback(
+        dash.dependencies.Output('rating-history', 'figure'),
+        [dash.dependencies.Input('result_scatter', 'hoverData'),
+         dash.dependencies.Input('xaxis-column', 'value'),
+         dash.dependencies.Input('rating-history', 'relayoutData')])(metrics.instrument('update_ratings')(update_ratings))
+else:
+    app.callback(
+        [dash.dependencies.Output('result_scatter', 'figure'),
+         dash.dependencies.Output('x-time-series', 'figure'),
+         dash.dependencies.Output('y-time-series', 'figure'),
+         dash.dependencies.Output('head-to-head', 'figure'),
+         dash.dependencies.Output('rating-history', 'figure')],
+        [dash.dependencies.Input('result_scatter', 'hoverData'),
+         dash.dependencies.Input('year', 'value'),
+         dash.dependencies.Input('yaxis-column', 'value'),
+         dash.dependencies.Input('xaxis-column', 'value'),
+         dash.dependencies.Input('tournament-filter', 'value'),
+         dash.dependencies.Input('series-span', 'value')] +
+        [dash.dependencies.Input(chart, 'relayoutData') for chart in ZOOM_CHARTS])(metrics.instrument('update_dashboard')(update_dashboard))
+
+
+#the year range view, the selected team's record for each year and the ranking of every team over the range
+#both come straight from the running totals, no games are looked at
+@figure_cache.memoize
+def range_figures(xaxis_column_name, yaxis_column_name, first_year, last_year):
+    stats = current_data().stats
+    with metrics.timed('filter'):
+        years = stats.team_years(xaxis_column_name, first_year, last_year, yaxis_column_name)
+        totals = stats.range_totals(first_year, last_year, yaxis_column_name)
+
+    with metrics.timed('figure'):
+        record = years.sum()
+        net = int(record['goals_for'] - record['goals_against'])
+        title = '<b>{} {} games from {} to {}</b> ({} played, {}W {}D {}L, goals {}-{}, net {:+d})'.format(
+            xaxis_column_name, yaxis_column_name, first_year, last_year, record['played'], record['wins'],
+            record['draws'], record['losses'], record['goals_for'], record['goals_against'], net)
+        figure = create_range_summary(years, title)
+
+        ranking = totals[totals['played'] >= RANKING_MIN_GAMES].copy()
+        ranking['net'] = ranking['goals_for'] - ranking['goals_against']
+        ranking['win_rate'] = (100.0 * ranking['wins'] / ranking['played']).round(1)
+        ranking = ranking.sort_values(['win_rate', 'played'], ascending=False, kind='mergesort')
+        rows = ranking[list(RANKING_COLUMNS)].rename(RANKING_COLUMNS, axis=1).to_dict('records')
+    heading = 'Ranking of teams with at least {} {} games from {} to {}, by win percentage'.format(
+        RANKING_MIN_GAMES, yaxis_column_name, first_year, last_year)
+    return figure, rows, heading
 
-    #filter the dataframe where the xaxis_column_name and country name is in away or home team
-    dff = df_raw[df_raw['home_team'].isin([xaxis_column_name, country_name])]
-    dff = dff[dff['away_team'].isin([xaxis_column_name, country_name])]
 
-    #give simple title
-    title = '<b>Graph shows {} head to head games for {} versus {}</b><br> Net Goals - A result above 0 shows a win for the user selected team'.format(yaxis_column_name, xaxis_column_name, country_name)
-
-    return create_hth(dff, xaxis_column_name, yaxis_column_name, title)
+@app.callback(
+    [dash.dependencies.Output('range-summary', 'figure'),
+     dash.dependencies.Output('range-ranking', 'data'),
+     dash.dependencies.Output('range-title', 'children')],
+    [dash.dependencies.Input('year-range', 'value'),
+     dash.dependencies.Input('yaxis-column', 'value'),
+     dash.dependencies.Input('xaxis-column', 'value')])
+@metrics.instrument('update_range')
+def update_range(year_range, yaxis_column_name, xaxis_column_name):
+    return range_figures(xaxis_column_name, yaxis_column_name, int(year_range[0]), int(year_range[1]))
 
 
-#finally a table to update that gives more information
+#the table has its own callback because it also changes when we page, sort or filter it
+#only the rows on the current page are sent back, however many games there are
 @app.callback(
-    dash.dependencies.Output('table-data', 'figure'),
-    [dash.dependencies.Input('result_scatter', 'hoverData'),
-     dash.dependencies.Input('year', 'value'),
+    [dash.dependencies.Output('table-data', 'data'),
+     dash.dependencies.Output('table-data', 'page_count'),
+     dash.dependencies.Output('table-title', 'children'),
+     dash.dependencies.Output('table-export', 'href')],
+    [dash.dependencies.Input('year', 'value'),
      dash.dependencies.Input('yaxis-column', 'value'),
-     dash.dependencies.Input('xaxis-column', 'value')])
-def update_table_data(hoverData, year_value, yaxis_column_name, xaxis_column_name):
-    #this table also uses hoverdata and gives more information about the team selected and the one we hover over
-    dff = df[df['year'] == year_value]
-    country_name = hoverData['points'][0]['customdata']
-    #these columns are not needed so lets remove them
-    dff.drop(['neutral', 'year','random', 'home_score', 'away_score'], axis=1, inplace=True)
-    #loop to handle Home vs Away
-    while True:
-        #this will rename some of the columns to make them more appealing
-        if yaxis_column_name == 'Home':
-            dff = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff.rename({'home_score1': 'Home Score', 'away_score1': 'Away Score',
-                        'date': 'Date', 'home_team': 'Home Team', 'away_team': 'Away Team',
-                        'tournament':'Tournament', 'city': 'City', 'country': 'Country'}, axis=1, inplace=True)
-            break
-        elif yaxis_column_name == 'All':
-            #if all is picked, we need to correctly choose the data that we want to show. I have created two tables
-            #and appended them, then we rename
-            dff_1 = dff[dff['home_team'].isin([xaxis_column_name])]
-            dff_2 = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff = dff_1.append(dff_2, ignore_index=True)
-            dff = dff.sort_values('date')
-            dff.rename({'home_score1': 'Home Score', 'away_score1': 'Away Score',
-                        'date': 'Date', 'home_team': 'Home Team', 'away_team': 'Away Team',
-                        'tournament':'Tournament', 'city': 'City', 'country': 'Country'}, axis=1, inplace=True)
-            break
-        else:
-            #this does a similiar thing to what is done for home
-            dff = dff[dff['away_team'].isin([xaxis_column_name])]
-            dff.rename({'home_score1': 'Home Score', 'away_score1': 'Away Score',
-                        'date': 'Date', 'home_team': 'Home Team', 'away_team': 'Away Team',
-                        'tournament':'Tournament', 'city': 'City', 'country': 'Country'}, axis=1, inplace=True)
-            break
-    #title that will update as the graph does
-    title = '<b>Table shows all {} games for {} in {}</b><br>'.format(yaxis_column_name, xaxis_column_name, year_value)
-    #create the table
-    new_table_figure = ff.create_table(dff)
-    #update margins
-    new_table_figure.layout.margin.update({'t':75, 'l':5})
-    #assign it the title
-    new_table_figure.layout.update({'title': title})
-    #change the font size slightly
-    for i in range(len(new_table_figure.layout.annotations)):
-        new_table_figure.layout.annotations[i].font.size = 11
-
-    return new_table_figure
+     dash.dependencies.Input('xaxis-column', 'value'),
+     dash.dependencies.Input('tournament-filter', 'value'),
+     dash.dependencies.Input('table-data', 'page_current'),
+     dash.dependencies.Input('table-data', 'page_size'),
+     dash.dependencies.Input('table-data', 'sort_by'),
+     dash.dependencies.Input('table-data', 'filter_query')])
+@metrics.instrument('update_table_data')
+def update_table_data(year_value, yaxis_column_name, xaxis_column_name, tournament_value, page_current, page_size,
+                      sort_by, filter_query):
+    #the sort is turned into a tuple so the page can be cached
+    sort_key = tuple((item['column_id'], item['direction']) for item in sort_by or [])
+    rows, page_count, title, export = table_page(xaxis_column_name, yaxis_column_name, year_value,
+                                                 selected_tournaments(tournament_value), page_current, page_size,
+                                                 sort_key, filter_query)
+    return rows, page_count, html.B(title), export
+
+#one page of the table, cached like the figures so the first page of popular views is ready straight away
+@figure_cache.memoize
+def table_page(xaxis_column_name, yaxis_column_name, year_value, tournaments, page_current, page_size, sort_key,
+               filter_query):
+    sort_by = [{'column_id': column, 'direction': direction} for column, direction in sort_key]
+    with metrics.timed('filter'):
+        dff = team_year_rows(xaxis_column_name, year_value, yaxis_column_name, tournaments)
+        total = len(dff)
+        #we never sort or filter more than the row cap
+        dff = filter_and_sort(table_rows(dff.iloc[:TABLE_ROW_CAP]), filter_query, sort_by)
+
+    page_size = min(page_size or TABLE_PAGE_SIZE, TABLE_MAX_PAGE_SIZE)
+    page_count = max(1, -(-len(dff) // page_size))
+    page_current = min(page_current or 0, page_count - 1)
+    page = dff.iloc[page_current * page_size:(page_current + 1) * page_size]
+
+    #title that will update as the table does
+    title = 'Table shows all {} games for {} in {}{}'.format(yaxis_column_name, xaxis_column_name, year_value,
+                                                             tournament_note(tournaments))
+    if total > TABLE_ROW_CAP:
+        title += ' (first {} of {} games)'.format(TABLE_ROW_CAP, total)
+    export = '/export/matches.csv?' + urlencode({'team': xaxis_column_name, 'venue': yaxis_column_name, 'year': year_value,
+                                                 'tournament': tournaments}, doseq=True)
+    return page.to_dict('records'), page_count, title, export
+
+
+#when a worker starts serving, and again after the data is reloaded, the views below are built in the background
+#so the first visitors after a deploy do not pay for them: the page people land on first, then the WARMUP_TEAMS
+#busiest teams since FIRST_YEAR for the last WARMUP_YEARS years and every venue, with WARMUP_THREADS threads
+#WARMUP_TEAMS=0 turns it off. The views go in the figure cache, so there is no point warming more than it holds
+WARMUP_TEAMS = int(os.environ.get('WARMUP_TEAMS', 0))
+WARMUP_YEARS = int(os.environ.get('WARMUP_YEARS', 3))
+warmup = Warmup(threads=int(os.environ.get('WARMUP_THREADS', 2)))
+metrics.add_collector(warmup.collect)
+
+#the views are listed most likely first, as the figure cache drops the oldest entries when it fills up
+#the list is cut to the size of the cache so the last views do not push out the first ones. Most views are one
+#cache entry, but the first hover view of a team also caches the team's ratings chart (comparison_figure)
+def warmup_tasks():
+    dataset = current_data()
+    played = dataset.stats.range_totals(FIRST_YEAR, dataset.stats.last_year, 'All').sort_values(
+        'played', ascending=False, kind='mergesort')
+    busiest = [team for team in played['team'][:WARMUP_TEAMS] if team != DEFAULT_TEAM]
+    years = [int(year) for year in dataset.years[::-1][:WARMUP_YEARS]]
+    tasks = []
+    #how many cache entries each task adds
+    entries = []
+
+    def add(label, function, cost=1):
+        tasks.append((label, function))
+        entries.append(cost)
+
+    for team in [DEFAULT_TEAM] + busiest:
+        rated = False
+        for year in years:
+            if CLIENTSIDE_HOVER:
+                add('{} {} bundle'.format(team, year), lambda team=team, year=year: hover_bundle(
+                    team, year, (), DEFAULT_COUNTRY))
+            for venue in available_indicators_homeaway[::-1]:
+                view = (team, venue, year)
+                add('{} {} {} figures'.format(*view), lambda view=view: selection_figures(*view + (DEFAULT_SPAN, ())))
+                add('{} {} {} hover'.format(*view), lambda view=view: hover_figures(*view + (DEFAULT_COUNTRY, DEFAULT_SPAN, ())),
+                    1 if rated else 2)
+                rated = True
+                add('{} {} {} table'.format(*view), lambda view=view: table_page(
+                    view[0], view[1], view[2], (), 0, TABLE_PAGE_SIZE, (), ''))
+        for venue in available_indicators_homeaway[::-1]:
+            view = (team, venue, FIRST_YEAR, int(dataset.stats.last_year))
+            add('{} {} range'.format(team, venue), lambda view=view: range_figures(*view))
+    fits = int(np.searchsorted(np.cumsum(entries), figure_cache.max_entries, side='right'))
+    if fits < len(tasks):
+        logger.warning('only warming up the first %d of %d views, the figure cache does not hold more', fits, len(tasks))
+    return tasks[:fits]
+
+#each view is built in a request context of its own, so its timings go on /metrics under 'warmup'
+def warmup_context(function):
+    with server.test_request_context():
+        flask.g.callback = 'warmup'
+        function()
+
+def start_warmup():
+    if WARMUP_TEAMS > 0 and figure_cache.enabled():
+        warmup.start(warmup_tasks(), warmup_context)
+
+
+#the download link streams every matching game as csv, a chunk of rows at a time,
+#so a big export never has to be built in memory in one go
+#leaving out the year gives the team's games for every year since 1872, and each tournament argument
+#keeps the games in that tournament, like the tournament filter does
+@server.route('/export/matches.csv')
+def export_matches():
+    team = flask.request.args.get('team', '')
+    venue = api_venue()
+    year = api_number('year')
+    tournaments = selected_tournaments(flask.request.args.getlist('tournament'))
+    if year is None:
+        dff = team_venue_rows(team, venue, tournaments)
+    else:
+        dff = team_year_rows(team, year, venue, tournaments)
+
+    #stream_with_context keeps the request, and so the dataset it started with, while the rows are sent
+    filename = '{}-{}-{}.csv'.format(team, venue, year if year is not None else 'all').replace(' ', '_')
+    return flask.Response(flask.stream_with_context(stream_rows(dff, table_rows, 'csv', EXPORT_CHUNK_ROWS)),
+                          mimetype='text/csv',
+                          headers={'Content-Disposition': 'attachment; filename="{}"'.format(filename)})
+
+
+#a read only api for the data behind the charts, everything is read from the same dataset the callbacks use
+#
+#    /api/v1/teams                                  every team, with how many games they have played and when
+#    /api/v1/teams/<team>/results?year=&venue=      a team's games from its point of view
+#    /api/v1/head-to-head/<team>/<opponent>?venue=  the games between two teams and a summary of the results
+#
+#both of those also take ?tournament=, as many times as needed, to keep only the games in those tournaments
+#    /api/v1/years/<year>?venue=                    every team's record in a year
+#    /api/v1/matches?from=&to=                      every game, in date order, optionally for a range of years
+#
+#the lists can come as json (the default), csv or ndjson with ?format=, csv and ndjson are streamed a chunk at a time
+#and /api/v1/matches only comes as csv or ndjson. Every response has an ETag of the data version and the
+#Last-Modified time of the csv, so a client that sends If-None-Match or If-Modified-Since gets a 304 until
+#new results are loaded
+
+#the venue and format query arguments, anything else is a 400
+def api_venue():
+    venue = flask.request.args.get('venue', 'All')
+    if venue not in available_indicators_homeaway:
+        flask.abort(400, 'venue must be one of {}'.format(', '.join(available_indicators_homeaway)))
+    return venue
+
+def api_format(allowed=('json', 'csv', 'ndjson'), default='json'):
+    fmt = flask.request.args.get('format', default)
+    if fmt not in allowed:
+        flask.abort(400, 'format must be one of {}'.format(', '.join(allowed)))
+    return fmt
+
+#a whole number query argument such as the year, or None if it is left out, anything else is a 400
+#flask's type=int would quietly treat a bad value as a missing one and send every year back
+def api_number(name):
+    value = flask.request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        flask.abort(400, '{} must be a whole number'.format(name))
+
+#a team's games in the dataset that this request uses, or a 404 for a team we do not know
+def api_team(team):
+    if team not in current_data().summary.index:
+        flask.abort(404, 'no games for {}'.format(team))
+    return team
+
+#the response, or a 304 if the client already has this version of the data
+#body is only called when it is needed, it returns the json value, or the rows and the function that
+#converts a chunk of them for csv and ndjson
+def api_response(fmt, body, filename='data'):
+    dataset = current_data()
+    headers = {'Cache-Control': 'no-cache'}
+    if not is_resource_modified(flask.request.environ, etag=dataset.version, last_modified=dataset.modified):
+        response = flask.Response(status=304, headers=headers)
+    elif fmt == 'json':
+        response = flask.jsonify(body())
+        response.headers.extend(headers)
+    else:
+        rows, convert = body()
+        headers['Content-Disposition'] = 'inline; filename="{}.{}"'.format(filename.replace(' ', '_'), fmt)
+        response = flask.Response(flask.stream_with_context(stream_rows(rows, convert, fmt, EXPORT_CHUNK_ROWS)),
+                                  content_type=STREAM_TYPES[fmt], headers=headers)
+    response.set_etag(dataset.version, weak=True)
+    response.last_modified = dataset.modified
+    return response
+
+#a team's games as the api sends them, dff is a slice of the long table
+def api_team_games(dff):
+    raw = current_data().queries.match_rows(dff['match'].to_numpy())
+    return pd.DataFrame({
+        'date': dff['date'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'team': np.asarray(dff['team'], dtype=object),
+        'opponent': np.asarray(dff['opponent'], dtype=object),
+        'venue': np.asarray(dff['venue'], dtype=object),
+        'goals_for': dff['goals_for'].to_numpy(),
+        'goals_against': dff['goals_against'].to_numpy(),
+        'tournament': np.asarray(raw['tournament'], dtype=object),
+        'city': np.asarray(raw['city'], dtype=object),
+        'country': np.asarray(raw['country'], dtype=object),
+        'neutral': raw['neutral'].to_numpy(),
+    })
+
+#json wants python numbers and strings, not numpy ones
+def api_records(frame):
+    return json.loads(frame.to_json(orient='records', force_ascii=False))
+
+@server.route('/api/v1/teams')
+def api_teams():
+    def body():
+        summary = current_data().summary
+        return [{'team': team, 'games': int(games), 'first_game': first.strftime('%Y-%m-%d'),
+                 'last_game': last.strftime('%Y-%m-%d')}
+                for team, games, first, last in zip(summary.index, summary['games'],
+                                                    pd.to_datetime(summary['first_game']),
+                                                    pd.to_datetime(summary['last_game']))]
+    return api_response('json', body)
+
+@server.route('/api/v1/teams/<team>/results')
+def api_team_results(team):
+    team, venue, fmt = api_team(team), api_venue(), api_format()
+    year = api_number('year')
+
+    tournaments = selected_tournaments(flask.request.args.getlist('tournament'))
+
+    def rows():
+        if year is not None:
+            return team_year_rows(team, year, venue, tournaments)
+        return team_venue_rows(team, venue, tournaments)
+
+    def body():
+        if fmt == 'json':
+            return {'team': team, 'venue': venue, 'year': year, 'games': api_records(api_team_games(rows()))}
+        return rows(), api_team_games
+    return api_response(fmt, body, '{}-{}-{}'.format(team, venue, year if year is not None else 'all'))
+
+@server.route('/api/v1/head-to-head/<team>/<opponent>')
+def api_head_to_head(team, opponent):
+    team, opponent, venue, fmt = api_team(team), api_team(opponent), api_venue(), api_format()
+    tournaments = selected_tournaments(flask.request.args.getlist('tournament'))
+
+    def body():
+        dff, summary = head_to_head(team, opponent, venue, tournaments)
+        games = pd.DataFrame({'date': dff['date'].dt.strftime('%Y-%m-%d').to_numpy(),
+                              'venue': np.asarray(dff['venue'], dtype=object),
+                              'goals_for': dff['goals_for'].to_numpy(),
+                              'goals_against': dff['goals_against'].to_numpy()})
+        if fmt == 'json':
+            return {'team': team, 'opponent': opponent, 'venue': venue, 'summary': summary,
+                    'games': api_records(games)}
+        return games, lambda chunk: chunk
+    return api_response(fmt, body, '{}-{}-{}'.format(team, opponent, venue))
+
+@server.route('/api/v1/years/<int:year>')
+def api_year(year):
+    venue, fmt = api_venue(), api_format()
+
+    def body():
+        totals = current_data().stats.range_totals(year, year, venue)
+        totals = totals[totals['played'] > 0].reset_index(drop=True)
+        totals['team'] = totals['team'].astype(object)
+        if fmt == 'json':
+            return {'year': year, 'venue': venue, 'teams': api_records(totals)}
+        return totals, lambda chunk: chunk
+    return api_response(fmt, body, '{}-{}'.format(year, venue))
+
+@server.route('/api/v1/matches')
+def api_matches():
+    fmt = api_format(allowed=('csv', 'ndjson'), default='csv')
+    first = api_number('from')
+    last = api_number('to')
+
+    def body():
+        queries = current_data().queries
+        start, stop = queries.year_span(first, last)
+
+        #only the match numbers are listed up front, each chunk's rows are read as it is sent
+        def convert(chunk):
+            chunk = queries.match_rows(chunk['match'].to_numpy())
+            chunk['date'] = chunk['date'].dt.strftime('%Y-%m-%d')
+            for column in chunk.select_dtypes('category').columns:
+                chunk[column] = chunk[column].astype(object)
+            return chunk
+        return pd.DataFrame({'match': np.arange(start, stop)}), convert
+    return api_response(fmt, body, 'matches-{}-{}'.format(first or 'all', last or 'all'))
 
 
 if __name__ == '__main__':
@@ -614,6 +1568,3 @@ if __name__ == '__main__':
 
 #TO DO
 #ability to select opponent team
-#get data from an API
-#filter on tournament data
-#regression
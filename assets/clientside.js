@@ -0,0 +1,108 @@
+// these functions draw the hover charts in the browser when the app runs with CLIENTSIDE_HOVER set
+// they use the bundle the server puts in the 'team-bundle' store and build the same figures as
+// create_time_series and create_hth in International_Football_Scores_App.py, so keep the two in step
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    football: {
+        hover_figures: function(hoverData, venue, bundle) {
+            if (!bundle || !hoverData) {
+                var no_update = window.dash_clientside.no_update;
+                return [no_update, no_update, no_update];
+            }
+            var country = hoverData.points[0].customdata;
+            var teamCode = bundle.teams.indexOf(bundle.team);
+            var countryCode = bundle.teams.indexOf(country);
+
+            // Home, Away or All, home is 1 when the team played at home
+            function venueMatches(home) {
+                return venue === 'All' || (venue === 'Home') === (home === 1);
+            }
+
+            // picks out the rows of a columnar table that pass the test, keeping them in date order
+            function select(columns, test) {
+                var rows = [];
+                for (var i = 0; i < columns.date.length; i++) {
+                    if (test(i)) {
+                        rows.push(i);
+                    }
+                }
+                return rows;
+            }
+
+            function netGoals(columns, rows) {
+                return rows.map(function(i) { return columns.goals_for[i] - columns.goals_against[i]; });
+            }
+
+            // the form and trend lines that go over a team's results
+            function line(x, y, name, style) {
+                return {'type': 'scatter', 'x': x, 'y': y, 'name': name, 'mode': 'lines', 'hoverinfo': 'y+name',
+                        'showlegend': false, 'line': style};
+            }
+
+            function figure(x, net, text, title, overlay) {
+                return {
+                    'data': [{
+                        'type': 'scatter',
+                        'x': x,
+                        'y': net,
+                        'text': text,
+                        'mode': 'lines+markers',
+                        'marker': {
+                            'size': 8,
+                            'opacity': 0.9,
+                            'color': net.map(function(value) { return -value; }),
+                            'line': {'width': 0.5, 'color': 'black'}
+                        }
+                    }].concat(overlay || []),
+                    'layout': {
+                        'xaxis': {'autorange': true},
+                        'height': 225,
+                        'margin': {'l': 20, 'b': 30, 'r': 10, 't': 10},
+                        'annotations': [{
+                            'x': 0, 'y': 0.85, 'xanchor': 'left', 'yanchor': 'bottom',
+                            'xref': 'paper', 'yref': 'paper', 'showarrow': false,
+                            'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
+                            'text': title
+                        }]
+                    }
+                };
+            }
+
+            // a team's games in the selected year, from the season part of the bundle
+            function seasonFigure(code, name) {
+                var season = bundle.season;
+                var rows = select(season, function(i) {
+                    return season.team[i] === code && venueMatches(season.home[i]);
+                });
+                var title = '<b>' + name + ' ' + venue + ' Results in ' + bundle.year +
+                    '</b><br>Net Goals - Above Zero Equals a Win, Below Equals a Loss';
+                var dates = rows.map(function(i) { return season.date[i]; });
+                var overlay = [
+                    line(dates, rows.map(function(i) { return season.form[i]; }),
+                         'Form (last ' + bundle.form_games + ')', {'width': 1.5, 'color': 'grey', 'dash': 'dot'}),
+                    line(dates, rows.map(function(i) { return season.trend[i]; }),
+                         'Trend', {'width': 1.5, 'color': 'orange'})
+                ];
+                return figure(dates, netGoals(season, rows),
+                              rows.map(function(i) { return bundle.teams[season.opponent[i]]; }), title, overlay);
+            }
+
+            // the head to head comes from every game the selected team has played
+            var history = bundle.history;
+            var rows = select(history, function(i) {
+                return history.opponent[i] === countryCode && venueMatches(history.home[i]);
+            });
+            var net = netGoals(history, rows);
+            var wins = net.filter(function(value) { return value > 0; }).length;
+            var draws = net.filter(function(value) { return value === 0; }).length;
+            var total = net.reduce(function(sum, value) { return sum + value; }, 0);
+            var dates = rows.map(function(i) { return history.date[i]; });
+            var title = '<b>Graph shows ' + venue + ' head to head games for ' + bundle.team + ' versus ' + country +
+                '</b> (' + rows.length + ' played, ' + wins + 'W ' + draws + 'D ' + (rows.length - wins - draws) +
+                'L, net goals ' + (total >= 0 ? '+' : '') + total + ')' +
+                '<br> Net Goals - A result above 0 shows a win for the user selected team';
+
+            return [seasonFigure(teamCode, bundle.team), seasonFigure(countryCode, country),
+                    figure(dates, net, dates, title)];
+        }
+    }
+});
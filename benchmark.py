@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+#this measures how long the functions behind the callbacks take, and how much memory they use at their peak
+#it calls them directly (no browser or http) across a matrix of teams, venues and years
+#it can also make a bigger copy of results.csv (10x, 100x, 1000x...) so we can see where things stop scaling
+#
+#    python benchmark.py                         the real data
+#    python benchmark.py --scales 1 10 100       the real data, then 10x and 100x synthetic data
+#    python benchmark.py --save base.json        keep the results to compare against later
+#    python benchmark.py --compare base.json     flag anything that got slower than the saved results
+#
+#the app loads its data when it is imported, so each scale is measured in its own python process
+
+SOURCE_CSV = 'Data/results.csv'
+VENUES = ['Home', 'Away', 'All']
+
+
+#this makes a results.csv shaped file with scale times as many games
+#every column is drawn from the real data, so the teams, tournaments, scores and dates look the same,
+#teams just play more often. The file is written in chunks so 1000x does not need to fit in memory
+def synthesise_results(source_csv, scale, out_path, seed=0, chunk_rows=1000000):
+    source = pd.read_csv(source_csv)
+    random = np.random.RandomState(seed)
+    dates = np.sort(pd.to_datetime(source['date']).values)
+    total = len(source) * scale
+    #the dates are spread over the real ones in order, so the file comes out sorted by date
+    positions = np.linspace(0, len(dates) - 1, total).round().astype(int)
+    with open(out_path, 'w') as handle:
+        for start in range(0, total, chunk_rows):
+            size = min(chunk_rows, total - start)
+            rows = source.iloc[random.randint(0, len(source), size)].reset_index(drop=True)
+            home = source['home_team'].values[random.randint(0, len(source), size)]
+            away = source['away_team'].values[random.randint(0, len(source), size)]
+            #a team can not play itself, redraw those away teams until none are left
+            same = home == away
+            while same.any():
+                away[same] = source['away_team'].values[random.randint(0, len(source), same.sum())]
+                same = home == away
+            chunk = pd.DataFrame({
+                'date': pd.to_datetime(dates[positions[start:start + size]]).strftime('%Y-%m-%d'),
+                'home_team': home,
+                'away_team': away,
+                'home_score': source['home_score'].values[random.randint(0, len(source), size)],
+                'away_score': source['away_score'].values[random.randint(0, len(source), size)],
+                'tournament': rows['tournament'],
+                'city': rows['city'],
+                'country': rows['country'],
+                'neutral': rows['neutral'],
+            })
+            chunk.to_csv(handle, index=False, header=start == 0)
+    return out_path
+
+
+#picks the teams that have played the most games, and a spread of years from the slider
+def benchmark_matrix(app, teams, years):
+    stats = app.data.stats
+    counts = stats.range_totals(app.FIRST_YEAR, stats.last_year, 'All').sort_values('played', ascending=False,
+                                                                                     kind='mergesort')
+    all_years = sorted(app.data.years)
+    picked_years = sorted(set(all_years[int(i)] for i in np.linspace(0, len(all_years) - 1, years)))
+    return list(counts['team'][:teams]), picked_years
+
+
+#the country we pretend to hover over, the first opponent the team played that year
+def hover_country(app, team, year):
+    opponents = app.team_year_rows(team, year, 'All')['opponent']
+    return opponents.iloc[0] if len(opponents) else team
+
+
+#these are the functions we time, each one takes a team, venue, year and hovered country
+def benchmark_calls(app):
+    return {
+        'selection_figures': lambda team, venue, year, country: app.selection_figures(team, venue, year, app.DEFAULT_SPAN, ()),
+        'hover_figures': lambda team, venue, year, country: app.hover_figures(team, venue, year, country, app.DEFAULT_SPAN, ()),
+        'update_table_data': lambda team, venue, year, country: app.update_table_data(year, venue, team, [], 0, app.TABLE_PAGE_SIZE, [], ''),
+        'team_bundle': lambda team, venue, year, country: app.hover_bundle(team, year, (), country),
+        'head_to_head': lambda team, venue, year, country: app.head_to_head(team, country, venue),
+    }
+
+
+#times every function for every combination, then runs each once more under tracemalloc for the peak memory
+#the timing runs are done without tracemalloc because it slows everything down
+def run_benchmarks(app, teams, years, repeat):
+    team_list, year_list = benchmark_matrix(app, teams, years)
+    combinations = [(team, venue, year, hover_country(app, team, year))
+                    for team in team_list for venue in VENUES for year in year_list]
+    results = {}
+    for name, call in benchmark_calls(app).items():
+        timings = []
+        for combination in combinations:
+            call(*combination)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                call(*combination)
+                timings.append(time.perf_counter() - start)
+        peak = 0
+        for combination in combinations:
+            tracemalloc.start()
+            call(*combination)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        timings = np.array(timings) * 1000
+        results[name] = {
+            'calls': len(timings),
+            'mean_ms': float(timings.mean()),
+            'p50_ms': float(np.percentile(timings, 50)),
+            'p95_ms': float(np.percentile(timings, 95)),
+            'p99_ms': float(np.percentile(timings, 99)),
+            'max_ms': float(timings.max()),
+            'peak_kib': peak / 1024.0,
+        }
+    return results
+
+
+#this runs inside the child process, it imports the app against the csv we are testing and prints json
+def run_scale(args):
+    #the figure cache would turn every repeat into a dictionary lookup, so it is switched off
+    os.environ['FIGURE_CACHE_ENTRIES'] = '0'
+    os.environ['RESULTS_CSV'] = args.csv
+    os.environ['RESULTS_CACHE_DIR'] = args.cache_dir
+    start = time.perf_counter()
+    import International_Football_Scores_App as app
+    load_seconds = time.perf_counter() - start
+    results = run_benchmarks(app, args.teams, args.years, args.repeat)
+    print(json.dumps({'rows': app.data.games, 'import_s': load_seconds, 'results': results}))
+
+
+def print_report(scale, report, baseline=None, threshold=0.2):
+    print('\nscale {}x: {} games, import {:.2f}s'.format(scale, report['rows'], report['import_s']))
+    print('{:<20} {:>7} {:>9} {:>9} {:>9} {:>9} {:>10}'.format('function', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'peak KiB'))
+    for name, row in report['results'].items():
+        line = '{:<20} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.0f}'.format(
+            name, row['calls'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms'], row['peak_kib'])
+        #compare the median with the saved run, and flag it if it is more than the threshold slower
+        old = (baseline or {}).get(str(scale), {}).get('results', {}).get(name)
+        if old:
+            change = row['p50_ms'] / old['p50_ms'] - 1
+            line += '  {:+.0%}{}'.format(change, '  SLOWER' if change > threshold else '')
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the callbacks of the football scores app')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1], help='dataset sizes to test, 1 is the real data')
+    parser.add_argument('--teams', type=int, default=5, help='how many of the busiest teams to test')
+    parser.add_argument('--years', type=int, default=4, help='how many years to test, spread across the slider')
+    parser.add_argument('--repeat', type=int, default=5, help='timed calls per combination')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'football-benchmark'),
+                        help='where the synthetic csv files and their caches are kept')
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--compare', help='compare with results saved by --save')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown that counts as a regression')
+    #these are only used when the script runs itself for one scale
+    parser.add_argument('--csv', help=argparse.SUPPRESS)
+    parser.add_argument('--cache-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.csv:
+        run_scale(args)
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+    reports = {}
+    regressions = False
+    for scale in args.scales:
+        csv_path = SOURCE_CSV
+        if scale != 1:
+            csv_path = os.path.join(args.data_dir, 'results-{}x.csv'.format(scale))
+            if not os.path.exists(csv_path):
+                print('writing {}x synthetic data to {}'.format(scale, csv_path))
+                synthesise_results(SOURCE_CSV, scale, csv_path)
+        output = subprocess.check_output([
+            sys.executable, __file__, '--csv', csv_path, '--cache-dir', os.path.join(args.data_dir, 'cache'),
+            '--teams', str(args.teams), '--years', str(args.years), '--repeat', str(args.repeat)])
+        report = json.loads(output.decode().strip().splitlines()[-1])
+        reports[str(scale)] = report
+        print_report(scale, report, baseline, args.threshold)
+        if baseline and str(scale) in baseline:
+            old_results = baseline[str(scale)]['results']
+            regressions = regressions or any(
+                name in old_results and row['p50_ms'] > old_results[name]['p50_ms'] * (1 + args.threshold)
+                for name, row in report['results'].items())
+
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump(reports, handle, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import numpy as np
+
+#a team's whole history is over a thousand games, and a chart with that many markers makes the browser slow to hover
+#this picks the points to draw with largest triangle three buckets (LTTB): the points are split into equal buckets
+#and from each one we keep the point that makes the biggest triangle with the point kept before it and the average
+#of the next bucket. It keeps the peaks and dips that make the shape of the line, which an average would smooth away
+#the first and last points are always kept, so the line still covers the whole range
+
+
+#returns the positions of the points to keep, in order, x must be increasing
+#if there are no more than threshold points they are all kept
+def lttb(x, y, threshold):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+
+    #the points between the first and the last are split into threshold - 2 buckets
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, size - 1
+    kept = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        #the next bucket, or the last point for the last bucket
+        if bucket + 2 < len(edges):
+            next_start, next_stop = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_stop = size - 1, size
+        next_x, next_y = x[next_start:next_stop].mean(), y[next_start:next_stop].mean()
+        #twice the area of each triangle, the halving does not change which one is biggest
+        area = np.abs((x[kept] - next_x) * (y[start:stop] - y[kept]) - (x[kept] - x[start:stop]) * (next_y - y[kept]))
+        kept = start + int(np.argmax(area))
+        keep[bucket + 1] = kept
+    return keep
@@ -0,0 +1,117 @@
+import functools
+import json
+import threading
+from collections import OrderedDict
+
+import plotly
+
+#the charts are pure functions of the dropdowns, the year and the country we hover over
+#so the same popular views (like the default England / All / latest year) were being rebuilt on every request
+#this is a small least-recently-used cache for the finished figures, it is bounded both by the number of
+#figures and by their size, and it keeps count of hits, misses and evictions so we can see how well it is doing
+#it is also tied to a data version, which is part of every key, so after a reload the figures of the new data are
+#filed separately and the old ones are evicted as they go unused. Requests that still hold the older data keep
+#finding their figures rather than emptying the cache for each other
+#it can sit in front of a SharedCache (see shared_cache.py), then a figure another worker has built is used
+#rather than built again
+
+
+#the json that dash will send for a figure, newer versions of plotly have a faster way of making it
+def figure_json(figure):
+    try:
+        from plotly.io.json import to_json_plotly
+    except ImportError:
+        return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+    return to_json_plotly(figure)
+
+
+#this works out roughly how big a figure is, we use the length of the json that dash will send
+def figure_size(figure):
+    return len(figure_json(figure))
+
+
+class FigureCache(object):
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, version=None, shared=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        #this is a function that returns the current data version, it is read once for every lookup
+        self.version = version
+        #the SharedCache behind this one, if there is one
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    #a size of zero for either limit turns the cache off
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            #move it to the end so it is the last thing to be evicted
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        #anything bigger than the whole cache is not worth keeping
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            #evict the least recently used figures until we are back under both limits
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+    #this is the decorator we put on the figure functions, the data version and the arguments become the cache key
+    #so they need to be simple values like team names and years
+    #figures that come from the shared cache are plain json, so lists and dicts rather than tuples and plotly objects
+    def memoize(self, function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            if not self.enabled():
+                return function(*args)
+            #the version is read before the figure is built, so it is filed under the data it was built from
+            version = str(self.version()) if self.version is not None else ''
+            key = (function.__name__,) + args
+            figure = self.get((version,) + key)
+            if figure is not None:
+                return figure
+            if self.shared is None:
+                figure = function(*args)
+                self.put((version,) + key, figure, figure_size(figure))
+                return figure
+            text = self.shared.get(key, version)
+            if text is not None:
+                figure = json.loads(text)
+            else:
+                figure = function(*args)
+                text = figure_json(figure)
+                self.shared.put(key, version, text)
+            self.put((version,) + key, figure, len(text))
+            return figure
+        wrapper.cache = self
+        return wrapper
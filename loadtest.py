@@ -0,0 +1,314 @@
+import argparse
+import gzip
+import json
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+#benchmark.py times the functions behind the callbacks, this times what a visitor actually waits for
+#it starts the app under gunicorn and has a number of simulated visitors use it at the same time, each one:
+#
+#    opens the page, which fires every callback once like the browser does
+#    picks a team from the dropdown
+#    scrubs the year slider back through the last few years
+#    sweeps the mouse across the scatter, which fires the hover callback for each point
+#
+#the callbacks and the values they are sent come from the page itself (/_dash-layout and /_dash-dependencies),
+#so the sessions follow the app's callbacks as they change. The report has the requests per second and the
+#p50/p95/p99 latency of each callback, and the time the app says it spent (its Server-Timing header), the rest
+#of the latency is time spent waiting for a free worker
+#
+#    python loadtest.py                                          4 sync workers, 8 visitors
+#    python loadtest.py --workers 1 2 4 --worker-class sync gthread --threads 4
+#    python loadtest.py --url http://localhost:8050 --users 16   an app that is already running
+#    python loadtest.py --save run.json
+#
+#every combination of worker class and worker count is started, loaded and stopped in turn
+#environment variables are passed on to the app, so FIGURE_PATCH=1 python loadtest.py tests that mode
+
+APP = 'International_Football_Scores_App:server'
+CALLBACK_PATH = '/_dash-update-component'
+
+
+#a free port on this machine for gunicorn to listen on
+def free_port():
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return listener.getsockname()[1]
+
+
+#starts gunicorn the way the Procfile does and waits until it answers
+def start_gunicorn(port, workers, worker_class, threads, timeout, wait):
+    command = [sys.executable, '-m', 'gunicorn', APP, '--bind', '127.0.0.1:{}'.format(port),
+               '--workers', str(workers), '--worker-class', worker_class, '--timeout', str(timeout), '--preload']
+    if worker_class == 'gthread':
+        command += ['--threads', str(threads)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:{}'.format(port)
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with code {}, is it installed? (it is in requirements.txt)'.format(
+                process.returncode))
+        try:
+            urlopen(url + '/', timeout=5).read()
+            return process, url
+        except (URLError, OSError):
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('gunicorn did not answer within {} seconds'.format(wait))
+
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+#one request, returns the status, the decoded body, how long it took and the app's own time from Server-Timing
+def fetch(url, body=None, timeout=300):
+    headers = {'Accept-Encoding': 'gzip'}
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    start = time.perf_counter()
+    try:
+        response = urlopen(Request(url, data=data, headers=headers), timeout=timeout)
+        status, content, response_headers = response.status, response.read(), response.headers
+    except HTTPError as error:
+        status, content, response_headers = error.code, error.read(), error.headers
+    seconds = time.perf_counter() - start
+    if response_headers.get('Content-Encoding') == 'gzip':
+        content = gzip.decompress(content)
+    return status, content, seconds, server_ms(response_headers.get('Server-Timing'))
+
+
+#the total from a Server-Timing header like 'filter;dur=1.2, figure;dur=3.4, total;dur=5.0'
+def server_ms(header):
+    for part in (header or '').split(','):
+        name, _, duration = part.strip().partition(';dur=')
+        if name == 'total' and duration:
+            return float(duration)
+    return None
+
+
+#every component in the layout that has an id, with its properties
+def layout_components(node, found=None):
+    found = {} if found is None else found
+    if isinstance(node, list):
+        for child in node:
+            layout_components(child, found)
+    elif isinstance(node, dict):
+        props = node.get('props', {})
+        if 'id' in props:
+            found[props['id']] = props
+        layout_components(props.get('children'), found)
+    return found
+
+
+#a dependency's outputs as 'id.property' strings, several outputs come as '..a.b...c.d..'
+def dependency_outputs(dependency):
+    output = dependency['output']
+    if output.startswith('..'):
+        return output[2:-2].split('...')
+    return [output]
+
+
+#the points of a scatter figure from a callback response, either a whole figure or, with FIGURE_PATCH, a patch
+def figure_points(figure):
+    if isinstance(figure, dict) and 'data' in figure:
+        traces = figure['data']
+    else:
+        traces = [operation['params']['value'] for operation in (figure or {}).get('operations', [])
+                  if operation.get('location') == ['data']]
+        traces = traces[0] if traces else []
+    return [point for trace in traces for point in (trace.get('customdata') or [])]
+
+
+class Session(object):
+
+    def __init__(self, url, timings, random_state):
+        self.url = url
+        self.timings = timings
+        self.random = random_state
+        self.values = {}
+
+    #opens the page and fires every callback with its starting values, like the browser does
+    def open_page(self):
+        self.get('/', 'page')
+        self.layout = layout_components(json.loads(self.get('/_dash-layout', 'page')))
+        self.dependencies = [dependency for dependency in json.loads(self.get('/_dash-dependencies', 'page'))
+                             if not dependency.get('clientside_function')]
+        for component, props in self.layout.items():
+            for name, value in props.items():
+                self.values['{}.{}'.format(component, name)] = value
+        for dependency in self.dependencies:
+            self.fire(dependency, [])
+
+    def get(self, path, label):
+        status, content, seconds, server = fetch(self.url + path)
+        self.timings.add(label, status, seconds, server)
+        return content
+
+    #posts one callback with the current values of its inputs and state, and keeps the outputs it sends back
+    def fire(self, dependency, changed):
+        def value(item):
+            return {'id': item['id'], 'property': item['property'],
+                    'value': self.values.get('{}.{}'.format(item['id'], item['property']))}
+
+        outputs = dependency_outputs(dependency)
+        body = {'output': dependency['output'],
+                'outputs': [dict(zip(('id', 'property'), output.rsplit('.', 1))) for output in outputs],
+                'inputs': [value(item) for item in dependency['inputs']],
+                'state': [value(item) for item in dependency.get('state', [])],
+                'changedPropIds': changed}
+        if len(outputs) == 1:
+            body['outputs'] = body['outputs'][0]
+        status, content, seconds, server = fetch(self.url + CALLBACK_PATH, body)
+        self.timings.add(','.join(output.rsplit('.', 1)[0] for output in outputs), status, seconds, server)
+        #a 204 means the callback did not update anything
+        if status == 200:
+            for component, props in json.loads(content).get('response', {}).items():
+                for name, value in props.items():
+                    self.values['{}.{}'.format(component, name)] = value
+
+    #changes a value the way a visitor would and fires every callback that listens to it
+    def change(self, prop, value):
+        self.values[prop] = value
+        for dependency in self.dependencies:
+            if any('{}.{}'.format(item['id'], item['property']) == prop for item in dependency['inputs']):
+                self.fire(dependency, [prop])
+
+    def run(self, years, hovers, think):
+        self.open_page()
+        teams = [option['value'] for option in self.layout['xaxis-column']['options']]
+        self.change('xaxis-column.value', self.random.choice(teams))
+        time.sleep(think)
+        marks = sorted(int(year) for year in self.layout['year']['marks'])
+        for year in marks[::-1][:years]:
+            self.change('year.value', year)
+            time.sleep(think)
+        points = figure_points(self.values.get('result_scatter.figure'))
+        for country in points[:hovers]:
+            self.change('result_scatter.hoverData', {'points': [{'customdata': country}]})
+            time.sleep(think)
+
+
+#the latencies of every request, by callback
+class Timings(object):
+
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.server = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, label, status, seconds, server):
+        with self.lock:
+            self.latency[label].append(seconds * 1000)
+            if server is not None:
+                self.server[label].append(server)
+            if status >= 400:
+                self.errors[label] += 1
+
+    def report(self, seconds):
+        requests = sum(len(values) for values in self.latency.values())
+        rows = {}
+        for label, values in sorted(self.latency.items()):
+            values = np.array(values)
+            server = np.array(self.server.get(label) or [np.nan])
+            rows[label] = {'requests': len(values), 'errors': self.errors[label],
+                           'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95)),
+                           'p99_ms': float(np.percentile(values, 99)), 'max_ms': float(values.max()),
+                           'server_p50_ms': float(np.percentile(server, 50))}
+        return {'requests': requests, 'errors': sum(self.errors.values()), 'seconds': seconds,
+                'requests_per_second': requests / seconds if seconds else 0.0, 'callbacks': rows}
+
+
+#runs users visitors at once, each one running sessions sessions one after the other
+def run_load(url, args):
+    timings = Timings()
+
+    def visitor(number):
+        for session in range(args.sessions):
+            Session(url, timings, random.Random(args.seed + number * 1000 + session)).run(
+                args.years, args.hovers, args.think_ms / 1000.0)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(visitor, range(args.users)))
+    return timings.report(time.perf_counter() - start)
+
+
+def print_report(name, report):
+    print('\n{}: {} requests in {:.1f}s, {:.1f} requests/s, {} errors'.format(
+        name, report['requests'], report['seconds'], report['requests_per_second'], report['errors']))
+    print('{:<48} {:>8} {:>9} {:>9} {:>9} {:>9} {:>11}'.format(
+        'callback', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'server p50'))
+    for label, row in report['callbacks'].items():
+        print('{:<48} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>11.1f}'.format(
+            label[:48], row['requests'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms'],
+            row['server_p50_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the football scores app with simulated visitors')
+    parser.add_argument('--url', help='test an app that is already running here instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, nargs='+', default=[4], help='gunicorn worker counts to compare')
+    parser.add_argument('--worker-class', nargs='+', default=['sync'], help='gunicorn worker classes to compare')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker for the gthread class')
+    parser.add_argument('--timeout', type=int, default=300, help='gunicorn worker timeout, as in the Procfile')
+    parser.add_argument('--users', type=int, default=8, help='visitors using the app at the same time')
+    parser.add_argument('--sessions', type=int, default=3, help='sessions each visitor runs')
+    parser.add_argument('--years', type=int, default=5, help='years each session scrubs through on the slider')
+    parser.add_argument('--hovers', type=int, default=20, help='scatter points each session hovers over')
+    parser.add_argument('--think-ms', type=float, default=50, help='pause between a visitor\'s actions')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the teams the visitors pick')
+    parser.add_argument('--start-timeout', type=float, default=120, help='seconds to wait for gunicorn to start')
+    parser.add_argument('--save', help='write the reports to this json file')
+    args = parser.parse_args()
+
+    reports = {}
+    if args.url:
+        reports['url'] = run_load(args.url.rstrip('/'), args)
+        print_report(args.url, reports['url'])
+    else:
+        for worker_class in args.worker_class:
+            for workers in args.workers:
+                name = '{} x{}'.format(worker_class, workers)
+                if worker_class == 'gthread':
+                    name += ' ({} threads)'.format(args.threads)
+                process, url = start_gunicorn(free_port(), workers, worker_class, args.threads, args.timeout,
+                                              args.start_timeout)
+                try:
+                    reports[name] = run_load(url, args)
+                finally:
+                    stop_gunicorn(process)
+                print_report(name, reports[name])
+
+    if len(reports) > 1:
+        print('\n{:<32} {:>12} {:>12} {:>12}'.format('server', 'requests/s', 'worst p95', 'worst p99'))
+        for name, report in reports.items():
+            rows = report['callbacks'].values()
+            print('{:<32} {:>12.1f} {:>12.1f} {:>12.1f}'.format(name, report['requests_per_second'],
+                                                            max(row['p95_ms'] for row in rows),
+                                                            max(row['p99_ms'] for row in rows)))
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump(reports, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
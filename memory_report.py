@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from results_cache import TEXT_COLUMNS, load_results
+
+#this measures how much memory the results take in a worker and how quick the team filters are,
+#for the compact types the app uses (text as codes into shared dictionaries, int8 scores) against the plain types
+#(a python string in every cell and 64 bit numbers) the app used before
+#each one is loaded from the binary cache in its own python process, like a worker does,
+#so the resident memory of one does not count towards the other
+#
+#    python memory_report.py
+#    python memory_report.py --csv /tmp/football-benchmark/results-100x.csv
+#
+#it also reports the resident memory of a worker that has imported the whole app
+
+SOURCE_CSV = 'Data/results.csv'
+
+
+#the resident memory of this process in MiB, from /proc on linux, otherwise the peak that getrusage gives
+def resident_mib():
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.0 / 1024.0
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+#the frame the way the app used to hold it, python strings and 64 bit numbers
+def plain_results(frame):
+    frame = frame.copy()
+    for column in TEXT_COLUMNS:
+        frame[column] = np.asarray(frame[column].astype(object), dtype=object)
+    for column in ('home_score', 'away_score', 'year'):
+        frame[column] = frame[column].astype(np.int64)
+    return frame
+
+
+#one row per (match, team) like the app's long table, built from whichever frame we are given
+def long_table(frame):
+    home = pd.DataFrame({'team': frame['home_team'].values, 'opponent': frame['away_team'].values,
+                         'goals_for': frame['home_score'].values, 'goals_against': frame['away_score'].values,
+                         'year': frame['year'].values})
+    away = pd.DataFrame({'team': frame['away_team'].values, 'opponent': frame['home_team'].values,
+                         'goals_for': frame['away_score'].values, 'goals_against': frame['home_score'].values,
+                         'year': frame['year'].values})
+    return pd.concat([home, away], ignore_index=True)
+
+
+#times the team and year filter for each team, on names for the plain types and on codes for the compact ones
+#this is the scan the callbacks used to do, and what anything without an index still has to do
+def time_filters(table, teams, year, compact, repeat):
+    if compact:
+        codes = table['team'].cat.codes.to_numpy()
+        names = table['team'].cat.categories
+        values = [names.get_loc(team) for team in teams]
+    else:
+        codes = table['team'].to_numpy()
+        values = teams
+    years = table['year'].to_numpy()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for value in values:
+            np.flatnonzero((codes == value) & (years == year))
+    return (time.perf_counter() - start) * 1000 / (repeat * len(values))
+
+
+#this runs in the child process for one of the layouts
+def measure_layout(args):
+    before = resident_mib()
+    frame = load_results(args.csv, args.cache_dir)[0]
+    if args.layout == 'plain':
+        frame = plain_results(frame)
+    table = long_table(frame)
+    after = resident_mib()
+    teams = list(pd.Series(np.asarray(table['team'].astype(object))).value_counts().index[:args.teams])
+    year = int(np.max(table['year']))
+    print(json.dumps({
+        'raw_mib': frame.memory_usage(deep=True).sum() / 1024.0 / 1024.0,
+        'long_mib': table.memory_usage(deep=True).sum() / 1024.0 / 1024.0,
+        'resident_mib': after - before,
+        'filter_ms': time_filters(table, teams, year, args.layout == 'compact', args.repeat),
+    }))
+
+
+#this runs in the child process that imports the app, like a gunicorn worker does
+def measure_app(args):
+    os.environ['RESULTS_CSV'] = args.csv
+    os.environ['RESULTS_CACHE_DIR'] = args.cache_dir
+    before = resident_mib()
+    import International_Football_Scores_App  # noqa: F401
+    print(json.dumps({'resident_mib': resident_mib(), 'import_mib': resident_mib() - before}))
+
+
+def child(args, *extra):
+    output = subprocess.check_output([sys.executable, __file__, '--csv', args.csv, '--cache-dir', args.cache_dir,
+                                      '--teams', str(args.teams), '--repeat', str(args.repeat)] + list(extra))
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the memory and filter speed of the results in a worker')
+    parser.add_argument('--csv', default=SOURCE_CSV, help='the results csv to load')
+    parser.add_argument('--cache-dir', default='Data/.cache', help='where the binary copy of the csv is kept')
+    parser.add_argument('--teams', type=int, default=20, help='how many of the busiest teams to filter on')
+    parser.add_argument('--repeat', type=int, default=20, help='timed filters per team')
+    #these are only used when the script runs itself
+    parser.add_argument('--layout', choices=['plain', 'compact'], help=argparse.SUPPRESS)
+    parser.add_argument('--app', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.layout:
+        measure_layout(args)
+        return
+    if args.app:
+        measure_app(args)
+        return
+
+    #build the cache first so neither child has to parse the csv
+    load_results(args.csv, args.cache_dir)
+    reports = dict((layout, child(args, '--layout', layout)) for layout in ('plain', 'compact'))
+    print('{:<10} {:>10} {:>10} {:>14} {:>12}'.format('types', 'raw MiB', 'long MiB', 'resident MiB', 'filter ms'))
+    for layout, report in reports.items():
+        print('{:<10} {:>10.2f} {:>10.2f} {:>14.1f} {:>12.3f}'.format(
+            layout, report['raw_mib'], report['long_mib'], report['resident_mib'], report['filter_ms']))
+    app = child(args, '--app')
+    print('\na worker with the app imported is {:.1f} MiB resident, {:.1f} MiB of it from the import'.format(
+        app['resident_mib'], app['import_mib']))
+
+
+if __name__ == '__main__':
+    main()
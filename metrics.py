@@ -0,0 +1,159 @@
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import flask
+
+#this times the callbacks while the app is running, so we can see which one is slow and where the time goes
+#each callback is split into phases: 'filter' (finding the rows), 'figure' (building the charts) and
+#'serialise' (dash turning the result into json and sending it, worked out as the rest of the request time)
+#the timings of the current request are sent back in a Server-Timing header, which browsers show in the network tab,
+#and running totals are served on /metrics in the text format prometheus reads
+#note that with gunicorn every worker keeps its own totals, /metrics shows the worker that answered
+
+logger = logging.getLogger(__name__)
+
+#the upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#the path dash posts callback requests to
+CALLBACK_PATH = '_dash-update-component'
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+
+
+#the lines for a collector from a dict of numbers, the names in gauges are gauges and the rest are counters
+def stats_lines(prefix, stats, gauges=()):
+    return ['# TYPE {0}_{1} {2}\n{0}_{1} {3}'.format(prefix, name, 'gauge' if name in gauges else 'counter', value)
+            for name, value in sorted(stats.items())]
+
+
+class Metrics(object):
+
+    def __init__(self, slow_ms=None):
+        #calls slower than this many milliseconds are logged along with their inputs, None turns it off
+        self.slow_ms = slow_ms
+        self.histograms = defaultdict(Histogram)
+        self.calls = defaultdict(int)
+        self.slow_calls = defaultdict(int)
+        #other parts of the app can add their own lines to /metrics, like the figure cache counters
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def observe(self, callback, phase, seconds):
+        with self.lock:
+            self.histograms[(callback, phase)].observe(seconds)
+        #keep the phases of the current request for the Server-Timing header
+        if flask.has_request_context():
+            flask.g.setdefault('phases', []).append((phase, seconds))
+
+    #times a phase of the callback that is running, for example
+    #    with metrics.timed('filter'):
+    #        dff = team_year_rows(...)
+    @contextmanager
+    def timed(self, phase):
+        callback = flask.g.get('callback', 'none') if flask.has_request_context() else 'none'
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(callback, phase, time.perf_counter() - start)
+
+    #this is the decorator for callback functions, it names the callback so the phases inside it are filed under it
+    def instrument(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if flask.has_request_context():
+                    flask.g.callback = name
+                with self.lock:
+                    self.calls[name] += 1
+                with self.timed('callback'):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    #hooks into flask so every request is timed and the /metrics route exists
+    def install(self, server):
+        server.before_request(self.start_request)
+        server.after_request(self.finish_request)
+        server.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def start_request(self):
+        flask.g.request_start = time.perf_counter()
+
+    def finish_request(self, response):
+        start = flask.g.get('request_start')
+        callback = flask.g.get('callback')
+        if start is None or callback is None or not flask.request.path.endswith(CALLBACK_PATH):
+            return response
+        total = time.perf_counter() - start
+        phases = flask.g.get('phases', [])
+        callback_seconds = sum(seconds for phase, seconds in phases if phase == 'callback')
+        self.observe(callback, 'serialise', max(total - callback_seconds, 0.0))
+        self.observe(callback, 'total', total)
+
+        #the header lists each phase once, adding up repeats
+        durations = defaultdict(float)
+        for phase, seconds in flask.g.get('phases', []):
+            durations[phase] += seconds
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.2f}'.format(phase, seconds * 1000) for phase, seconds in durations.items())
+
+        if self.slow_ms is not None and total * 1000 > self.slow_ms:
+            with self.lock:
+                self.slow_calls[callback] += 1
+            body = flask.request.get_json(silent=True) or {}
+            inputs = [(item.get('id'), item.get('property'), item.get('value')) for item in body.get('inputs', [])
+                      if isinstance(item, dict)]
+            phase_ms = dict((phase, round(seconds * 1000, 2)) for phase, seconds in durations.items())
+            logger.warning('slow callback %s took %.0f ms, phases (ms) %s, inputs %s', callback, total * 1000,
+                           json.dumps(phase_ms), json.dumps(inputs, default=str))
+        return response
+
+    def metrics_view(self):
+        return flask.Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    #writes everything out in the prometheus text format
+    def render(self):
+        lines = ['# HELP dash_callback_calls_total Callback calls.',
+                 '# TYPE dash_callback_calls_total counter']
+        with self.lock:
+            for name, count in sorted(self.calls.items()):
+                lines.append('dash_callback_calls_total{{callback="{}"}} {}'.format(name, count))
+            lines += ['# HELP dash_callback_slow_total Callback requests slower than the slow call threshold.',
+                      '# TYPE dash_callback_slow_total counter']
+            for name, count in sorted(self.slow_calls.items()):
+                lines.append('dash_callback_slow_total{{callback="{}"}} {}'.format(name, count))
+            lines += ['# HELP dash_callback_phase_seconds Time spent in each phase of a callback.',
+                      '# TYPE dash_callback_phase_seconds histogram']
+            for (name, phase), histogram in sorted(self.histograms.items()):
+                labels = 'callback="{}",phase="{}"'.format(name, phase)
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    lines.append('dash_callback_phase_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, count))
+                lines.append('dash_callback_phase_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, histogram.count))
+                lines.append('dash_callback_phase_seconds_sum{{{}}} {}'.format(labels, histogram.total))
+                lines.append('dash_callback_phase_seconds_count{{{}}} {}'.format(labels, histogram.count))
+        for collector in self.collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
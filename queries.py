@@ -0,0 +1,389 @@
+import glob
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from results_cache import TEXT_COLUMNS
+from shared_cache import thread_connection
+
+#the callbacks get their rows through one of these, never by reading the tables themselves
+#
+#    team_year_rows(team, year, venue)    a team's games in a year, from its point of view, in date order
+#    team_rows(team, venue='All')         every game a team has played
+#    head_to_head(team, opponent, venue)  the games between two teams from the first one's point of view,
+#                                         with a summary of the results
+#    match_rows(matches)                  the original rows of the games, in the order they are asked for
+#    year_span(first, last)               the (start, stop) of the match numbers of the games in the years first..last,
+#                                         the matches are numbered in date order so a range of years is a run of them
+#
+#the first three also take the tournaments to keep, leaving them out (or giving none) keeps every tournament
+#
+#PandasQueries answers from the tables and indexes the worker holds in memory, SqliteQueries from a sqlite file
+#with the same games in it and indexes on team, year and pair. Both return frames with the same columns and types,
+#so the charts and the table do not know which one they are reading from
+#the queries are the only thing that holds the rows of a dataset, with sqlite the worker keeps none of them
+
+#the venue codes in the long table, 0 is Home and 1 is Away
+VENUE_NAMES = ['Home', 'Away']
+
+no_rows = np.array([], dtype=np.intp)
+
+NO_RESULTS = {'played': 0, 'wins': 0, 'draws': 0, 'losses': 0, 'net': 0}
+
+
+#which tournaments are selected, as a true or false for each tournament code, or None to keep them all
+#picking out a selection's games is then one lookup per game with the game's code, rather than comparing names
+def tournament_lookup(categories, tournaments):
+    if not tournaments:
+        return None
+    selected = np.zeros(len(categories), dtype=bool)
+    codes = categories.get_indexer(list(tournaments))
+    selected[codes[codes >= 0]] = True
+    return selected
+
+#the summary of a head to head from the net goals of each game
+def summarise(net):
+    return {'played': len(net), 'wins': int((net > 0).sum()), 'draws': int((net == 0).sum()),
+            'losses': int((net < 0).sum()), 'net': int(net.sum())}
+
+
+class PandasQueries(object):
+
+    def __init__(self, df_raw, df_long, team_slices, team_year_index, pair_index):
+        self.df_raw = df_raw
+        self.df_long = df_long
+        self.team_slices = team_slices
+        self.team_year_index = team_year_index
+        self.pair_index = pair_index
+
+    #the selection's games that were played in the tournaments, the team and year indexes have already cut the
+    #rows down to a few, so this only looks at those
+    def only_tournaments(self, dff, tournaments):
+        selected = tournament_lookup(self.df_long['tournament'].cat.categories, tournaments)
+        if selected is None:
+            return dff
+        return dff[selected[dff['tournament'].cat.codes.to_numpy()]]
+
+    #a dictionary lookup rather than a scan
+    def team_year_rows(self, team, year, venue, tournaments=None):
+        rows = self.team_year_index.get((team, year, venue))
+        if rows is None:
+            return self.df_long.iloc[no_rows]
+        return self.only_tournaments(self.df_long.iloc[self.team_slices[team][0] + rows], tournaments)
+
+    def team_rows(self, team, venue='All', tournaments=None):
+        start, stop = self.team_slices.get(team, (0, 0))
+        dff = self.df_long.iloc[start:stop]
+        if venue != 'All':
+            dff = dff[dff['venue'].cat.codes.to_numpy() == VENUE_NAMES.index(venue)]
+        return self.only_tournaments(dff, tournaments)
+
+    #it only touches the games the two teams have played against each other
+    def head_to_head(self, team, opponent, venue, tournaments=None):
+        flipped = opponent < team
+        key = (opponent, team) if flipped else (team, opponent)
+        entry = self.pair_index.get(key)
+        if entry is None:
+            rows = self.df_long.iloc[no_rows]
+        else:
+            rows = self.df_long.iloc[self.team_slices[key[0]][0] + entry['rows']]
+
+        #the stored games are from the point of view of the team that comes first alphabetically
+        #if that is the opponent we swap the goals and the venue round
+        goals_for, goals_against = rows['goals_for'].to_numpy(), rows['goals_against'].to_numpy()
+        venues = rows['venue'].cat.codes.to_numpy()
+        if flipped:
+            goals_for, goals_against = goals_against, goals_for
+            venues = 1 - venues
+        dff = pd.DataFrame({'date': rows['date'].to_numpy(), 'goals_for': goals_for,
+                            'goals_against': goals_against, 'venue': pd.Categorical.from_codes(venues, VENUE_NAMES)})
+
+        selected = tournament_lookup(self.df_long['tournament'].cat.categories, tournaments)
+        if venue != 'All' or selected is not None:
+            keep = np.ones(len(dff), dtype=bool)
+            if venue != 'All':
+                keep &= venues == VENUE_NAMES.index(venue)
+            if selected is not None:
+                keep &= selected[rows['tournament'].cat.codes.to_numpy()]
+            dff = dff[keep]
+            summary = summarise((dff['goals_for'] - dff['goals_against']).to_numpy())
+        elif entry is not None:
+            #for all games the running totals already hold the answer
+            wins, losses, net = int(entry['cum_wins'][-1]), int(entry['cum_losses'][-1]), int(entry['cum_net'][-1])
+            if flipped:
+                wins, losses, net = losses, wins, -net
+            summary = {'played': len(entry['rows']), 'wins': wins, 'draws': int(entry['cum_draws'][-1]),
+                       'losses': losses, 'net': net}
+        else:
+            summary = dict(NO_RESULTS)
+        return dff, summary
+
+    def match_rows(self, matches):
+        return self.df_raw.iloc[np.asarray(matches)]
+
+    #df_raw is in date order, so the years are too and the range is found with a binary search
+    def year_span(self, first, last):
+        years = self.df_raw['year'].to_numpy()
+        start = np.searchsorted(years, first, side='left') if first is not None else 0
+        stop = np.searchsorted(years, last, side='right') if last is not None else len(years)
+        return int(start), int(max(start, stop))
+
+
+#the games and matches are stored as integers: the text columns as ids from the names table, the venue as its code
+#and the dates as nanoseconds, a missing score is NULL
+#a name keeps its id for good and a new name gets the next one, so the codes in memory can change when new names
+#arrive without touching the rows already in the file, each worker turns the ids into its own codes with a lookup
+#the games also carry each team's form, trend and rating after the game, so the worker does not keep those either
+#
+#each index covers one of the lookups, with the date and match on the end so the rows come out in date order
+#without a sort. The statements are written once with ? placeholders, sqlite3 prepares each one the first time
+#a connection runs it and keeps it for the next call
+SCHEMA = '''
+CREATE TABLE games (
+    match INTEGER NOT NULL, team INTEGER NOT NULL, opponent INTEGER NOT NULL, goals_for INTEGER NOT NULL,
+    goals_against INTEGER NOT NULL, venue INTEGER NOT NULL, date INTEGER NOT NULL, year INTEGER NOT NULL,
+    tournament INTEGER NOT NULL, form REAL NOT NULL, trend REAL NOT NULL, rating REAL NOT NULL
+);
+CREATE TABLE matches (
+    match INTEGER PRIMARY KEY, date INTEGER NOT NULL, home_team INTEGER NOT NULL, away_team INTEGER NOT NULL,
+    home_score INTEGER, away_score INTEGER, tournament INTEGER NOT NULL, city INTEGER NOT NULL,
+    country INTEGER NOT NULL, neutral INTEGER NOT NULL, year INTEGER NOT NULL
+);
+CREATE TABLE names (
+    dictionary TEXT NOT NULL, id INTEGER NOT NULL, name TEXT NOT NULL, PRIMARY KEY (dictionary, id)
+);
+CREATE INDEX games_team ON games (team, date, match);
+CREATE INDEX games_team_year ON games (team, year, date, match);
+CREATE INDEX games_pair ON games (team, opponent, date, match);
+CREATE INDEX matches_year ON matches (year, match);
+'''
+
+#the dictionary each text column's ids come from, the long table's teams are the same teams as df_raw's
+DICTIONARIES = dict(TEXT_COLUMNS, team='teams', opponent='teams')
+
+GAME_COLUMNS = ['match', 'team', 'opponent', 'goals_for', 'goals_against', 'venue', 'date', 'year', 'tournament',
+                'form', 'trend', 'rating']
+GAME_SELECT = 'SELECT {} FROM games '.format(', '.join(GAME_COLUMNS))
+#{} is where the tournament condition goes when some are selected
+TEAM_YEAR_SQL = GAME_SELECT + 'WHERE team = ? AND year = ?{} ORDER BY date, match'
+TEAM_YEAR_VENUE_SQL = GAME_SELECT + 'WHERE team = ? AND year = ? AND venue = ?{} ORDER BY date, match'
+TEAM_SQL = GAME_SELECT + 'WHERE team = ?{} ORDER BY date, match'
+TEAM_VENUE_SQL = GAME_SELECT + 'WHERE team = ? AND venue = ?{} ORDER BY date, match'
+PAIR_SQL = GAME_SELECT + 'WHERE team = ? AND opponent = ?{} ORDER BY date, match'
+PAIR_VENUE_SQL = GAME_SELECT + 'WHERE team = ? AND opponent = ? AND venue = ?{} ORDER BY date, match'
+#a team's last games before the ones being added, newest first
+LATEST_SQL = GAME_SELECT + 'WHERE team = ? ORDER BY date DESC, match DESC LIMIT ?'
+#{} is where the year bounds go
+YEAR_SPAN_SQL = 'SELECT MIN(match), MAX(match) FROM matches{}'
+NAMES_SQL = 'SELECT dictionary, id, name FROM names'
+#sqlite allows 999 placeholders in a statement in older versions, the matches are asked for in chunks below that
+MATCH_CHUNK = 500
+#this goes in the file name and changes whenever the tables do, so a file written by older code is not opened
+DATABASE_FORMAT = 3
+#how long the file of an older data version is kept
+KEEP_SECONDS = 3600
+
+
+#a column as a list of values for sqlite, ids is the id of each name in the column's dictionary
+#a missing score becomes None, which sqlite stores as NULL
+def stored_values(column, ids):
+    if column.name in DICTIONARIES:
+        lookup = np.array([ids[DICTIONARIES[column.name]][name] for name in column.cat.categories], dtype=np.int64)
+        return lookup[column.cat.codes.to_numpy()].tolist()
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy().astype(np.int64).tolist()
+    if np.issubdtype(column.dtype, np.datetime64):
+        return column.to_numpy().astype('datetime64[ns]').astype(np.int64).tolist()
+    if np.issubdtype(column.dtype, np.floating):
+        return [None if value != value else value for value in column.to_numpy().tolist()]
+    return column.to_numpy().tolist()
+
+#turns the values from sqlite back into a column of the type the frame in memory has, a NULL becomes NaN
+#codes turns the ids of a text column into the codes of its dtype
+def column_values(values, dtype, codes=None):
+    if isinstance(dtype, pd.CategoricalDtype):
+        values = np.array(values, dtype=np.intp)
+        return pd.Categorical.from_codes(codes[values] if codes is not None else values, dtype=dtype)
+    if np.issubdtype(dtype, np.datetime64):
+        return np.array(values, dtype=np.int64).astype('datetime64[ns]').astype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return np.array(values, dtype=np.float64).astype(dtype)
+    return np.array(values, dtype=np.int64).astype(dtype)
+
+#the rows sqlite gives back as one list of values per column
+def row_columns(rows, width):
+    return list(zip(*rows)) if rows else [()] * width
+
+#every dictionary in the file as {dictionary: {name: id}}
+def read_names(connection):
+    names = {}
+    for dictionary, number, name in connection.execute(NAMES_SQL):
+        names.setdefault(dictionary, {})[name] = number
+    return names
+
+
+#the file the games of one version of the csv are kept in
+def database_path(folder, version):
+    return os.path.join(folder, 'games-v{}-{}.sqlite'.format(DATABASE_FORMAT, version[:16]))
+
+#adds the rows of df_raw and df_long to the tables, df_raw's matches are numbered from first_match
+#the names the file does not have yet get the next ids of their dictionaries
+def insert_games(connection, df_raw, df_long, first_match):
+    ids = read_names(connection)
+    for column, dictionary in sorted(TEXT_COLUMNS.items()):
+        known = ids.setdefault(dictionary, {})
+        new = {name: len(known) + i for i, name in enumerate(
+            name for name in df_raw[column].cat.categories if name not in known)}
+        connection.executemany('INSERT INTO names (dictionary, id, name) VALUES (?, ?, ?)',
+                               [(dictionary, number, name) for name, number in new.items()])
+        known.update(new)
+    matches = df_raw.assign(match=np.arange(first_match, first_match + len(df_raw)))
+    for table, frame, columns in (('games', df_long, GAME_COLUMNS), ('matches', matches, list(matches.columns))):
+        rows = zip(*[stored_values(frame[column], ids) for column in columns])
+        connection.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+            table, ', '.join(columns), ', '.join('?' * len(columns))), rows)
+
+
+#writes the games and matches to a sqlite file named after the data version, unless it is already there
+#every worker loading the same data uses the same file, so the operating system keeps one copy of it in memory
+#with previous, the file of the data before some games were added to the end of the csv, that file is copied and
+#only the new games are added to it, df_raw and df_long are then just the new rows starting at first_match
+#a file is never changed once it is in place, so copying one another worker may be reading is safe
+#the file is written under another name and moved into place, so no worker opens one that is half written
+#the files of older versions are removed once they are an hour old, apart from the newest of them, as workers that
+#have not reloaded yet and requests that started before a reload may still be reading them
+def write_database(folder, version, df_raw, df_long, first_match=0, previous=None):
+    path = database_path(folder, version)
+    if os.path.exists(path):
+        return path
+    os.makedirs(folder, exist_ok=True)
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        if previous is not None:
+            shutil.copyfile(previous, temporary)
+        elif os.path.exists(temporary):
+            os.remove(temporary)
+        connection = sqlite3.connect(temporary)
+        try:
+            if previous is None:
+                connection.executescript(SCHEMA)
+            insert_games(connection, df_raw, df_long, first_match)
+            connection.commit()
+            #the statistics the query planner uses only change much when the whole file is written
+            if previous is None:
+                connection.execute('ANALYZE')
+        finally:
+            connection.close()
+        os.replace(temporary, path)
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    older = sorted(glob.glob(os.path.join(folder, 'games-*.sqlite')), key=os.path.getmtime)
+    for old in [name for name in older if name != path][:-1]:
+        try:
+            if os.path.getmtime(old) < time.time() - KEEP_SECONDS:
+                os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+class SqliteQueries(object):
+
+    #game_types and match_types are the dtypes of the long table and the original rows, the answers get the same ones
+    def __init__(self, path, game_types, match_types):
+        self.path = path
+        self.game_types = game_types
+        self.match_types = match_types
+        self.match_columns = list(match_types.index)
+        self.match_sql = 'SELECT match, {} FROM matches WHERE match IN ({{}})'.format(', '.join(self.match_columns))
+        self.local = threading.local()
+        #the ids of the names, and for each text column the code of each id in its dtype
+        #these grow with the number of names, not the number of games
+        self.ids = read_names(self.connection())
+        self.codes = {}
+        for column, dtype in list(game_types.items()) + list(match_types.items()):
+            if column in DICTIONARIES:
+                ids = self.ids[DICTIONARIES[column]]
+                codes = np.full(len(ids), -1, dtype=np.intp)
+                codes[list(ids.values())] = dtype.categories.get_indexer(list(ids))
+                self.codes[column] = codes
+        self.teams = self.ids['teams']
+
+    #one read only connection per thread (see shared_cache.py)
+    def connection(self):
+        return thread_connection(self.local, lambda: sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True))
+
+    #the rows as a frame with the dtypes of the frames in memory
+    def frame(self, rows, columns, types):
+        return pd.DataFrame({name: column_values(values, types[name], self.codes.get(name))
+                             for name, values in zip(columns, row_columns(rows, len(columns)))})
+
+    #the selected tournaments go in as a list of ids, which sqlite checks against each game the index found
+    def games(self, sql, parameters, tournaments=None):
+        if not tournaments:
+            sql = sql.format('')
+        else:
+            #-1 is never an id, so a selection of tournaments we do not know finds no games
+            known = self.ids['tournament']
+            numbers = [known[name] for name in tournaments if name in known] or [-1]
+            sql = sql.format(' AND tournament IN ({})'.format(', '.join('?' * len(numbers))))
+            parameters = tuple(parameters) + tuple(numbers)
+        return self.frame(self.connection().execute(sql, parameters).fetchall(), GAME_COLUMNS, self.game_types)
+
+    #a team we do not know has no games, -1 is never an id
+    def team_id(self, team):
+        return self.teams.get(team, -1)
+
+    def team_year_rows(self, team, year, venue, tournaments=None):
+        if venue == 'All':
+            return self.games(TEAM_YEAR_SQL, (self.team_id(team), int(year)), tournaments)
+        return self.games(TEAM_YEAR_VENUE_SQL, (self.team_id(team), int(year), VENUE_NAMES.index(venue)), tournaments)
+
+    def team_rows(self, team, venue='All', tournaments=None):
+        if venue == 'All':
+            return self.games(TEAM_SQL, (self.team_id(team),), tournaments)
+        return self.games(TEAM_VENUE_SQL, (self.team_id(team), VENUE_NAMES.index(venue)), tournaments)
+
+    #every game is stored from both sides, so the first team's side is read straight from the pair index
+    def head_to_head(self, team, opponent, venue, tournaments=None):
+        teams = (self.team_id(team), self.team_id(opponent))
+        if venue == 'All':
+            rows = self.games(PAIR_SQL, teams, tournaments)
+        else:
+            rows = self.games(PAIR_VENUE_SQL, teams + (VENUE_NAMES.index(venue),), tournaments)
+        dff = rows[['date', 'goals_for', 'goals_against', 'venue']]
+        return dff, summarise((dff['goals_for'] - dff['goals_against']).to_numpy())
+
+    def match_rows(self, matches):
+        matches = np.asarray(matches, dtype=np.int64)
+        found = []
+        for start in range(0, len(matches), MATCH_CHUNK):
+            chunk = matches[start:start + MATCH_CHUNK].tolist()
+            found.extend(self.connection().execute(self.match_sql.format(', '.join('?' * len(chunk))), chunk).fetchall())
+        frame = self.frame([row[1:] for row in found], self.match_columns, self.match_types)
+        #IN gives the rows back in any order, so they are put back in the order they were asked for
+        return frame.iloc[pd.Index([row[0] for row in found], dtype=np.int64).get_indexer(matches)].reset_index(drop=True)
+
+    #leaving out first or last leaves that end of the range open
+    def year_span(self, first, last):
+        bounds = [(condition, bound) for condition, bound in (('year >= ?', first), ('year <= ?', last))
+                  if bound is not None]
+        where = ' WHERE ' + ' AND '.join(condition for condition, bound in bounds) if bounds else ''
+        low, high = self.connection().execute(YEAR_SPAN_SQL.format(where),
+                                              [int(bound) for condition, bound in bounds]).fetchone()
+        return (0, 0) if low is None else (low, high + 1)
+
+    #each of the teams' last `count` games, oldest first, for carrying their form on when new games are added
+    def latest_games(self, teams, count):
+        frames = [self.games(LATEST_SQL, (self.team_id(team), count)).iloc[::-1] for team in teams]
+        if not frames:
+            return self.games(LATEST_SQL, (-1, 0))
+        return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,140 @@
+import os
+import tempfile
+
+import numpy as np
+
+#Elo ratings for every team after every game, in the style of the World Football Elo Ratings
+#every team starts on START_RATING and after each game the winner takes points from the loser:
+#
+#    expected = 1 / (10 ** (-difference / 400) + 1)
+#    change   = K * G * (result - expected)
+#
+#difference is the home team's rating minus the away team's, plus HOME_ADVANTAGE unless the ground was neutral,
+#result is 1 for a home win, 0.5 for a draw and 0 for a loss, K is bigger for the games that matter more
+#and G is bigger for wider margins
+#each rating depends on every game before it, so they have to be worked out one game at a time in date order,
+#which is far too slow to do in a callback. It is done once when the data is loaded and saved next to the results
+#cache, and when new games arrive it carries on from the ratings after the last game rather than starting again
+
+START_RATING = 1500.0
+HOME_ADVANTAGE = 100.0
+
+#K for the biggest tournaments, every other tournament's qualifiers get K_QUALIFICATION and the rest K_OTHER
+K_FACTORS = {'FIFA World Cup': 60, 'UEFA Euro': 50, 'Copa América': 50, 'African Cup of Nations': 50,
+             'AFC Asian Cup': 50, 'Gold Cup': 50, 'Confederations Cup': 50, 'Friendly': 20}
+K_QUALIFICATION = 40
+K_OTHER = 30
+
+#the version is part of the file name, bump it if the file layout or the way ratings are worked out changes
+RATINGS_FORMAT = 1
+
+
+def k_factor(tournament):
+    if tournament in K_FACTORS:
+        return K_FACTORS[tournament]
+    return K_QUALIFICATION if tournament.endswith('qualification') else K_OTHER
+
+
+class Ratings(object):
+
+    def __init__(self, home, away, current):
+        #the home and away teams' ratings after each game, in the order of df_raw
+        #a worker using the sqlite backend leaves these as None, the ratings are in the file with the games
+        self.home = home
+        self.away = away
+        #every team's rating after the last game, by name, this is where the next games carry on from
+        self.current = current
+
+    #the rating after each game of the long table, for the row's team
+    #first_match is the match number of the first game these ratings are for, when they only cover the newest games
+    def by_game(self, long_table, first_match=0):
+        matches = long_table['match'].to_numpy() - first_match
+        home = long_table['venue'].cat.codes.to_numpy() == 0
+        return np.where(home, self.home[matches], self.away[matches])
+
+
+#rates frame's games one at a time, frame is in date order and comes after the games current was worked out from
+#games without a score leave the ratings as they were
+def rate_games(frame, current):
+    current = dict(current)
+    tournaments = frame['tournament'].cat.categories
+    factors = np.array([k_factor(name) for name in tournaments], dtype=np.float64)[frame['tournament'].cat.codes.to_numpy()]
+    advantage = np.where(frame['neutral'].to_numpy(dtype=bool), 0.0, HOME_ADVANTAGE)
+    home_after = np.empty(len(frame), dtype=np.float32)
+    away_after = np.empty(len(frame), dtype=np.float32)
+    #plain python lists are much quicker than numpy for a loop that looks at one value at a time
+    rows = zip(frame['home_team'].astype(object).tolist(), frame['away_team'].astype(object).tolist(),
+               frame['home_score'].tolist(), frame['away_score'].tolist(), factors.tolist(), advantage.tolist())
+    for position, (home, away, home_score, away_score, k, home_advantage) in enumerate(rows):
+        home_rating = current.get(home, START_RATING)
+        away_rating = current.get(away, START_RATING)
+        if home_score == home_score and away_score == away_score:
+            margin = abs(home_score - away_score)
+            margin_factor = 1.0 if margin <= 1 else 1.5 if margin == 2 else (11.0 + margin) / 8.0
+            result = 1.0 if home_score > away_score else 0.5 if home_score == away_score else 0.0
+            expected = 1.0 / (10.0 ** ((away_rating - home_rating - home_advantage) / 400.0) + 1.0)
+            change = k * margin_factor * (result - expected)
+            home_rating += change
+            away_rating -= change
+            current[home] = home_rating
+            current[away] = away_rating
+        home_after[position] = home_rating
+        away_after[position] = away_rating
+    return home_after, away_after, current
+
+
+#the ratings for every game from the first, df_raw is in date order
+def build_ratings(df_raw):
+    return Ratings(*rate_games(df_raw, {}))
+
+
+#the ratings with new_rows added, carrying on from the ratings after the last game old has
+#old is not changed
+def extend_ratings(old, new_rows):
+    home, away, current = rate_games(new_rows, old.current)
+    return Ratings(np.concatenate([old.home, home]), np.concatenate([old.away, away]), current)
+
+
+#the file the ratings for one version of the csv are saved in
+def ratings_path(folder, version):
+    return os.path.join(folder, 'ratings-v{}-{}.npz'.format(RATINGS_FORMAT, version[:16]))
+
+
+#saves the ratings to a temporary file and renames it, so a worker never reads a half written file
+#the files for other versions are removed, a worker that still uses one already has it in memory
+def save_ratings(folder, version, ratings):
+    os.makedirs(folder, exist_ok=True)
+    path = ratings_path(folder, version)
+    handle, staging = tempfile.mkstemp(prefix='.ratings-', suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            teams = sorted(ratings.current)
+            np.savez(output, home=ratings.home, away=ratings.away, teams=np.array(teams, dtype=str),
+                     current=np.array([ratings.current[team] for team in teams], dtype=np.float64))
+        os.replace(staging, path)
+    except Exception:
+        if os.path.exists(staging):
+            os.remove(staging)
+        raise
+    for name in os.listdir(folder):
+        if name.startswith('ratings-') and os.path.join(folder, name) != path:
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+    return path
+
+
+#loads the ratings saved for a version of the csv, or returns None if there are none for its games
+def load_ratings(folder, version, games):
+    path = ratings_path(folder, version)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as saved:
+            ratings = Ratings(saved['home'], saved['away'], dict(zip(saved['teams'].tolist(), saved['current'].tolist())))
+    except (OSError, ValueError, KeyError):
+        return None
+    if len(ratings.home) != games:
+        return None
+    return ratings
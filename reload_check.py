@@ -0,0 +1,155 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from results_cache import load_results
+
+#this checks that picking up new results without a restart gives the same data as loading the csv from scratch
+#it writes a copy of the csv without its last rows, has the app load it, adds the rows back (along with a game for
+#a team the app has never seen and a fixture that has not been played yet) and reloads. The dataset the reload
+#extended is then compared with one built from the whole file: the games, the indexes, the running totals, the
+#form and trend, the ratings and the rows every query returns
+#each backend runs in its own python process, as the backend is picked when the app is imported
+#
+#    python reload_check.py
+#    python reload_check.py --appended 2000 --backends sqlite
+
+SOURCE_CSV = 'Data/results.csv'
+
+#the games added after the real ones, a team with a city and country that are not in the csv yet and a fixture
+#with no score. {0} and {1} are the two days after the last game in the csv
+EXTRA_ROWS = ['{0},Atlantis,England,1,2,Friendly,Poseidonia,Atlantis,TRUE',
+              '{1},England,Atlantis,,,Friendly,London,England,FALSE']
+
+
+#writes the csv the app starts with and returns the lines to add to it later
+def write_fixture(source_csv, path, appended):
+    with open(source_csv) as handle:
+        lines = handle.read().splitlines()
+    last_date = pd.Timestamp(lines[-1].split(',')[0])
+    extra = [row.format(*[(last_date + pd.Timedelta(days=day)).strftime('%Y-%m-%d') for day in (1, 2)])
+             for row in EXTRA_ROWS]
+    with open(path, 'w') as handle:
+        handle.write('\n'.join(lines[:-appended]) + '\n')
+    return lines[-appended:] + extra
+
+
+#the things that differ between the two datasets, an empty list if they are the same
+def compare_datasets(app, extended, full):
+    problems = []
+
+    def check(same, what):
+        if not same:
+            problems.append(what)
+
+    check(extended.games == full.games, 'number of games')
+    check(extended.last_date == full.last_date, 'last date')
+    check(list(extended.teams) == list(full.teams), 'teams')
+    check(list(extended.years) == list(full.years), 'years')
+    check(list(extended.tournaments) == list(full.tournaments), 'tournaments')
+    check(extended.summary.equals(full.summary), 'team summary')
+    check(extended.form_ranking.reset_index(drop=True).equals(full.form_ranking.reset_index(drop=True)), 'form ranking')
+    check(list(extended.stats.teams) == list(full.stats.teams) and np.array_equal(extended.stats.prefix, full.stats.prefix),
+          'stats cube')
+    check(extended.ratings.current == full.ratings.current, 'current ratings')
+
+    #the pandas backend keeps the tables and indexes in the worker, so they are compared as they are
+    if app.QUERY_BACKEND == 'pandas':
+        old, new = extended.queries, full.queries
+        check(old.df_raw.equals(new.df_raw), 'games table')
+        check(old.df_long.equals(new.df_long), 'long table')
+        check(old.team_slices == new.team_slices, 'team slices')
+        check(set(old.team_year_index) == set(new.team_year_index) and all(
+            np.array_equal(old.team_year_index[key], new.team_year_index[key]) for key in new.team_year_index),
+            'team and year index')
+        check(set(old.pair_index) == set(new.pair_index) and all(
+            np.array_equal(old.pair_index[key][name], new.pair_index[key][name])
+            for key in new.pair_index for name in new.pair_index[key]), 'pair index')
+
+    #the rows the queries return, whichever backend they come from
+    def same_rows(first, second):
+        return first.reset_index(drop=True).equals(second.reset_index(drop=True))
+
+    if extended.games == full.games:
+        matches = np.arange(full.games)
+        check(same_rows(extended.queries.match_rows(matches), full.queries.match_rows(matches)), 'match rows')
+    year = int(full.years[-1])
+    for team in full.summary.index:
+        check(same_rows(extended.queries.team_rows(team, 'All'), full.queries.team_rows(team, 'All')),
+              'rows for {}'.format(team))
+        for venue in ('Home', 'Away'):
+            check(same_rows(extended.queries.team_year_rows(team, year, venue), full.queries.team_year_rows(team, year, venue)),
+                  'rows for {} {} in {}'.format(team, venue, year))
+    for team, opponent in (('England', 'Atlantis'), ('England', 'Scotland'), ('France', 'Belgium')):
+        first, second = extended.queries.head_to_head(team, opponent, 'All'), full.queries.head_to_head(team, opponent, 'All')
+        check(same_rows(first[0], second[0]) and first[1] == second[1], 'head to head {} {}'.format(team, opponent))
+    for span in ((None, None), (year, year), (year - 1, None)):
+        check(extended.queries.year_span(*span) == full.queries.year_span(*span), 'years {} to {}'.format(*span))
+    return problems
+
+
+#this runs in the child process for one backend
+def check_backend(args):
+    os.environ['RESULTS_CSV'] = os.path.join(args.folder, 'results.csv')
+    os.environ['RESULTS_CACHE_DIR'] = os.path.join(args.folder, 'cache')
+    os.environ['QUERY_DB_DIR'] = os.path.join(args.folder, 'db')
+    os.environ['QUERY_BACKEND'] = args.backend
+    os.environ['SHARED_CACHE_PATH'] = ''
+    os.environ['WARMUP_TEAMS'] = '0'
+    new_lines = write_fixture(args.csv, os.environ['RESULTS_CSV'], args.appended)
+    import International_Football_Scores_App as app
+
+    with open(app.RESULTS_CSV, 'a') as handle:
+        handle.write('\n'.join(new_lines) + '\n')
+    summary = app.reload_data()
+    frame, version, size = load_results(app.RESULTS_CSV)
+    #the full build gets a version of its own, so it does not reuse the ratings or database the reload wrote
+    full = app.build_dataset(frame, 'full-' + version, size)
+
+    problems = compare_datasets(app, app.data, full)
+    if summary['mode'] != 'incremental':
+        problems.insert(0, 'the reload was {}, not incremental'.format(summary['mode']))
+    if summary['added'] != len(new_lines):
+        problems.insert(0, 'the reload added {} games, not {}'.format(summary['added'], len(new_lines)))
+    print('{}: {} games added, {}'.format(args.backend, summary['added'],
+                                          'same as a full load' if not problems else 'differs in:'))
+    for problem in problems:
+        print('    ' + problem)
+    sys.exit(1 if problems else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that reloading new results matches loading them from scratch')
+    parser.add_argument('--csv', default=SOURCE_CSV, help='the results csv the fixture is made from')
+    parser.add_argument('--appended', type=int, default=500, help='how many of its last games are added by the reload')
+    parser.add_argument('--backends', nargs='+', default=['pandas', 'sqlite'], choices=['pandas', 'sqlite'])
+    #these are only used when the script runs itself
+    parser.add_argument('--backend', choices=['pandas', 'sqlite'], help=argparse.SUPPRESS)
+    parser.add_argument('--folder', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        check_backend(args)
+        return
+
+    failed = []
+    for backend in args.backends:
+        folder = tempfile.mkdtemp(prefix='football-reload-')
+        try:
+            status = subprocess.call([sys.executable, __file__, '--csv', args.csv, '--appended', str(args.appended),
+                                      '--backend', backend, '--folder', folder])
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        if status != 0:
+            failed.append(backend)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
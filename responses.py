@@ -0,0 +1,91 @@
+import gzip
+
+import flask
+
+from metrics import CALLBACK_PATH
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#this makes the callback responses smaller and quicker to build
+#most of a response is the figures' number arrays, which compress very well, so callback responses are gzipped
+#(or brotli compressed when the brotli package is installed and the browser asks for it)
+#it also has the helpers for the data only mode, where a callback sends the traces and the few layout values that
+#change, and the rest of the layout is sent once in the initial page
+
+
+#picks the encoding to use from the browser's Accept-Encoding header, brotli first as it is smaller
+def choose_encoding(accept_encoding):
+    accepted = set(part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(','))
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class Compression(object):
+
+    def __init__(self, min_bytes=1024, level=5):
+        #responses smaller than this are not worth compressing
+        self.min_bytes = min_bytes
+        #gzip levels go from 1 to 9 and brotli from 0 to 11, the middle is a good balance of size and cpu
+        self.level = level
+
+    def install(self, server):
+        server.after_request(self.compress)
+
+    def compress(self, response):
+        if not flask.request.path.endswith(CALLBACK_PATH):
+            return response
+        if response.direct_passthrough or response.status_code != 200 or 'Content-Encoding' in response.headers:
+            return response
+        response.headers.add('Vary', 'Accept-Encoding')
+        encoding = choose_encoding(flask.request.headers.get('Accept-Encoding'))
+        body = response.get_data()
+        if encoding is None or len(body) < self.min_bytes:
+            return response
+        if encoding == 'br':
+            body = brotli.compress(body, quality=self.level)
+        else:
+            body = gzip.compress(body, compresslevel=self.level)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+#turns a finished figure into a dash Patch that replaces the traces and only the layout values listed in paths
+#each path is a list of keys into the layout, for example ['annotations', 0, 'text']
+#the rest of the layout is whatever the graph already has, which is the static layout from the initial page
+def figure_patch(patch, figure, paths):
+    layout = figure['layout']
+    if hasattr(layout, 'to_plotly_json'):
+        layout = layout.to_plotly_json()
+    patch['data'] = figure['data']
+    for path in paths:
+        target = patch['layout']
+        value = layout
+        for key in path[:-1]:
+            target = target[key]
+            value = value[key]
+        target[path[-1]] = value[path[-1]]
+    return patch
+
+
+#the formats the data api can stream and their media types
+STREAM_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+#turns rows into csv or ndjson a chunk at a time, so a big export is never held in memory as one string
+#convert is called on each chunk of rows and gives the frame to write out
+def stream_rows(rows, convert, fmt, chunk_rows=1000):
+    if fmt == 'csv':
+        yield ','.join(convert(rows.iloc[:0]).columns) + '\n'
+    for start in range(0, len(rows), chunk_rows):
+        chunk = convert(rows.iloc[start:start + chunk_rows])
+        if fmt == 'csv':
+            yield chunk.to_csv(index=False, header=False)
+        else:
+            yield chunk.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n'
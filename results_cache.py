@@ -0,0 +1,252 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+#parsing the csv and converting the dates happens in every gunicorn worker when the app is imported
+#to avoid that we convert the csv once into a folder of .npy files, one per column, and load them memory-mapped
+#the folder name includes a fingerprint of the csv, so if the csv changes a new cache is built automatically
+#the text columns are stored as integer codes plus a list of the unique values, which keeps every file mappable
+
+#in memory the text columns are pandas categoricals, small integer codes pointing into a sorted list of names,
+#so a worker does not hold a python string per cell and comparing teams is comparing numbers
+#the home and away team columns share one list (the 'teams' dictionary), so a team has the same code in both
+#and the order of the codes is the alphabetical order of the names
+#this maps each text column to the dictionary it uses
+TEXT_COLUMNS = {'home_team': 'teams', 'away_team': 'teams', 'tournament': 'tournament', 'city': 'city',
+                'country': 'country'}
+
+#the scores are small so they are kept as int8 (or as floats if there are missing scores) and the year as int16
+SMALL_INT_COLUMNS = ['home_score', 'away_score', 'year']
+
+#true or false columns, a missing or unreadable value is false, so the column is always plain bools
+BOOL_COLUMNS = ['neutral']
+
+#the version is part of the folder name, bump it if the layout of the cache changes
+CACHE_FORMAT = 2
+
+
+#the csv may be read while a row is still being written, so a row only counts once the newline after it is there
+#this is how many bytes of the file are complete lines, found by looking back from the end for the last newline
+def complete_size(csv_path):
+    with open(csv_path, 'rb') as source:
+        position = source.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(1 << 16, position)
+            source.seek(position - step)
+            newline = source.read(step).rfind(b'\n')
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+
+#this works out the fingerprint of the csv, it is the hash of the file contents so it does not depend on timestamps
+#only the complete lines are hashed, and it also returns how many bytes that is, which is where the next reload
+#starts reading new rows from
+def source_fingerprint(csv_path):
+    digest = hashlib.sha1()
+    remaining = size = complete_size(csv_path)
+    with open(csv_path, 'rb') as source:
+        while remaining > 0:
+            chunk = source.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest(), size - remaining
+
+
+#this is the folder that holds the cache for one version of the csv
+def cache_folder(cache_dir, fingerprint):
+    return os.path.join(cache_dir, 'results-v{}-{}'.format(CACHE_FORMAT, fingerprint[:16]))
+
+
+#the names in a dictionary, from every column that uses it
+def dictionary_values(frame, dictionary):
+    names = [frame[column] for column, name in TEXT_COLUMNS.items() if name == dictionary and column in frame]
+    return np.unique(np.concatenate([np.asarray(column.astype(object), dtype=object) for column in names]).astype(str))
+
+
+#converts the columns of a parsed frame to the compact types described at the top
+#dictionaries can give the names to use for some of them, for example the ones the app already has
+def compact_results(frame, dictionaries=None):
+    frame = frame.copy()
+    dictionaries = dict(dictionaries or {})
+    for column, dictionary in TEXT_COLUMNS.items():
+        if column not in frame:
+            continue
+        if dictionary not in dictionaries:
+            dictionaries[dictionary] = pd.Index(dictionary_values(frame, dictionary))
+        frame[column] = pd.Categorical(np.asarray(frame[column].astype(object), dtype=object),
+                                       categories=dictionaries[dictionary])
+    for column in SMALL_INT_COLUMNS:
+        if column in frame:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce', downcast='integer')
+    for column in BOOL_COLUMNS:
+        if column in frame:
+            frame[column] = frame[column].astype(str).str.strip().str.lower().isin(['true', '1']).to_numpy()
+    return frame
+
+
+#gives two compact frames the same dictionaries, the union of both, so they can be joined without losing the codes
+#the names stay sorted, so if there is a new name the codes after it move up by one
+def align_dictionaries(first, second):
+    first, second = first.copy(), second.copy()
+    for dictionary in set(TEXT_COLUMNS.values()):
+        columns = [column for column, name in TEXT_COLUMNS.items() if name == dictionary and column in first]
+        if not columns:
+            continue
+        union = first[columns[0]].cat.categories.union(second[columns[0]].cat.categories)
+        for column in columns:
+            if not first[column].cat.categories.equals(union):
+                first[column] = first[column].cat.set_categories(union)
+            if not second[column].cat.categories.equals(union):
+                second[column] = second[column].cat.set_categories(union)
+    return first, second
+
+
+#parse the csv the slow way, this is what the app used to do at import
+#it also takes a file object, which is how the rows added since the last load are read
+def parse_results(csv_path, **read_csv_args):
+    frame = pd.read_csv(csv_path, **read_csv_args)
+    frame['date'] = pd.to_datetime(frame['date'])
+    frame['year'] = frame['date'].dt.year
+    return compact_results(frame)
+
+
+#parses the first size bytes of the csv, the complete lines source_fingerprint counted
+def parse_complete(csv_path, size):
+    with open(csv_path, 'rb') as source:
+        return parse_results(io.BytesIO(source.read(size)))
+
+
+#this converts a parsed frame into the .npy files and writes them to the cache folder
+#it writes to a temporary folder first and renames it at the end, so a worker never sees a half written cache
+#if two workers build the cache at the same time the first rename wins and the other copy is thrown away
+#every column has to be a plain numeric, bool or date array, a column of python objects could not be memory-mapped
+#when it is read back, so it is refused before anything is written
+def write_cache(frame, folder, fingerprint):
+    for column in frame.columns:
+        if column not in TEXT_COLUMNS and np.asarray(frame[column].values).dtype == object:
+            raise ValueError('column {} holds python objects and cannot be cached'.format(column))
+    parent = os.path.dirname(folder)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.building-', dir=parent)
+    try:
+        columns = []
+        for column in frame.columns:
+            if column in TEXT_COLUMNS:
+                #the codes are saved with the integer type pandas uses for them, so they can be mapped as they are
+                np.save(os.path.join(staging, column + '.codes.npy'), frame[column].cat.codes.to_numpy())
+                np.save(os.path.join(staging, TEXT_COLUMNS[column] + '.values.npy'),
+                        np.asarray(frame[column].cat.categories, dtype=str))
+            else:
+                np.save(os.path.join(staging, column + '.npy'), np.asarray(frame[column].values))
+            columns.append(column)
+        manifest = {'format': CACHE_FORMAT, 'fingerprint': fingerprint, 'rows': len(frame), 'columns': columns}
+        with open(os.path.join(staging, 'manifest.json'), 'w') as handle:
+            json.dump(manifest, handle)
+        try:
+            os.rename(staging, folder)
+        except OSError:
+            #another worker got there first
+            shutil.rmtree(staging, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+#this loads the cache folder back into a dataframe
+#the number and date columns are memory-mapped, so the operating system shares the pages between workers
+#the text columns are rebuilt from their codes, which is a quick lookup rather than parsing
+def read_cache(folder):
+    with open(os.path.join(folder, 'manifest.json')) as handle:
+        manifest = json.load(handle)
+    data = {}
+    dictionaries = {}
+    for column in manifest['columns']:
+        if column in TEXT_COLUMNS:
+            dictionary = TEXT_COLUMNS[column]
+            if dictionary not in dictionaries:
+                values = np.load(os.path.join(folder, dictionary + '.values.npy')).astype(object)
+                dictionaries[dictionary] = pd.Index(values)
+            codes = np.load(os.path.join(folder, column + '.codes.npy'), mmap_mode='r')
+            data[column] = pd.Categorical.from_codes(codes, categories=dictionaries[dictionary])
+        else:
+            data[column] = np.load(os.path.join(folder, column + '.npy'), mmap_mode='r')
+    return pd.DataFrame(data, columns=manifest['columns'], copy=False)
+
+
+#this removes caches built from older versions of the csv
+def remove_stale_caches(cache_dir, keep):
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith('results-') and path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+#this writes the cache for a frame the app already has, for example after new rows were added to it
+def store_results(frame, cache_dir, fingerprint):
+    folder = cache_folder(cache_dir, fingerprint)
+    if not os.path.exists(os.path.join(folder, 'manifest.json')):
+        write_cache(frame, folder, fingerprint)
+        remove_stale_caches(cache_dir, folder)
+
+
+#this is what the app calls, it returns the same dataframe the app used to build by hand
+#along with the fingerprint of the csv, which the app uses as its data version, and the size of the file
+#if the cache is missing or the csv has changed it parses the csv and builds the cache first
+#a cache that cannot be read would fail the same way on every start, so it is removed and the csv parsed instead,
+#and if the cache cannot be written the parsed frame is used without it
+#setting cache_dir to None skips the cache completely
+def load_results(csv_path, cache_dir=None):
+    fingerprint, size = source_fingerprint(csv_path)
+    if cache_dir is None:
+        return parse_complete(csv_path, size), fingerprint, size
+    folder = cache_folder(cache_dir, fingerprint)
+    if os.path.exists(os.path.join(folder, 'manifest.json')):
+        try:
+            return read_cache(folder), fingerprint, size
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(folder, ignore_errors=True)
+    frame = parse_complete(csv_path, size)
+    try:
+        write_cache(frame, folder, fingerprint)
+        remove_stale_caches(cache_dir, folder)
+        return read_cache(folder), fingerprint, size
+    except (OSError, ValueError, KeyError):
+        return frame, fingerprint, size
+
+
+#new results are added to the end of the csv, so when it changes we only want to parse the new part
+#this checks that the first previous_size bytes are still the file we loaded (their hash is the old fingerprint)
+#and if so parses just the bytes after them. It returns the new rows with the new fingerprint and size,
+#or None if the start of the file changed too, in which case the whole file has to be loaded again
+#the file may be read while a row is still being written, so only the complete lines are parsed, and the size
+#and fingerprint stop at the end of the last one. The rest is picked up by the next reload
+def load_appended(csv_path, previous_size, previous_fingerprint):
+    digest = hashlib.sha1()
+    with open(csv_path, 'rb') as source:
+        header = source.readline()
+        source.seek(0)
+        remaining = previous_size
+        while remaining > 0:
+            chunk = source.read(min(1 << 20, remaining))
+            if not chunk:
+                return None
+            digest.update(chunk)
+            remaining -= len(chunk)
+        if digest.hexdigest() != previous_fingerprint:
+            return None
+        tail = source.read()
+    tail = tail[:tail.rfind(b'\n') + 1]
+    digest.update(tail)
+    names = header.decode('utf-8').strip().split(',')
+    rows = parse_results(io.BytesIO(tail), header=None, names=names)
+    return rows, digest.hexdigest(), previous_size + len(tail)
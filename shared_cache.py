@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+#each gunicorn worker has its own figure cache, so with four workers a view is built up to four times
+#this is a second level of cache that every worker on the machine shares, it is a sqlite file so it needs
+#nothing running beside the app. Entries are keyed by the function and its arguments and stamped with the data
+#version they were built from, a worker only uses entries built from the data it has loaded
+#the values are stored as compressed json, and the file is kept under a size limit by dropping the entries
+#that were used longest ago
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (key, version)
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+'''
+
+
+#one connection per thread, and a new one after a fork as sqlite connections must not cross processes
+#local is the caller's threading.local and connect opens a new connection
+def thread_connection(local, connect):
+    connection = getattr(local, 'connection', None)
+    if connection is None or local.pid != os.getpid():
+        connection = connect()
+        local.connection = connection
+        local.pid = os.getpid()
+    return connection
+
+
+class SharedCache(object):
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, check_every=20):
+        self.path = path
+        self.max_bytes = max_bytes
+        #the total size is only checked every check_every writes, summing the sizes on every write costs too much
+        self.check_every = check_every
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        return thread_connection(self.local, self.connect)
+
+    def connect(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        #write ahead logging lets the workers read while one of them writes
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        return connection
+
+    #the key is the json of the function name and the arguments, tuples and lists come out the same
+    @staticmethod
+    def make_key(key):
+        return json.dumps(key, separators=(',', ':'), default=str)
+
+    #returns the json text stored for the key and version, or None
+    #a broken or locked database counts as a miss, the cache must never stop the app answering
+    def get(self, key, version):
+        try:
+            connection = self.connection()
+            row = connection.execute('SELECT value FROM entries WHERE key = ? AND version = ?',
+                                     (self.make_key(key), version)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE entries SET used = ? WHERE key = ? AND version = ?',
+                                   (time.time(), self.make_key(key), version))
+        except sqlite3.Error:
+            logger.exception('reading the shared cache %s failed', self.path)
+            with self.lock:
+                self.errors += 1
+            return None
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    #stores the json text of a value
+    def put(self, key, version, text):
+        value = zlib.compress(text.encode('utf-8'), 1)
+        if len(value) > self.max_bytes:
+            return
+        try:
+            connection = self.connection()
+            connection.execute('INSERT OR REPLACE INTO entries (key, version, value, size, used) VALUES (?, ?, ?, ?, ?)',
+                               (self.make_key(key), version, value, len(value), time.time()))
+            with self.lock:
+                self.writes += 1
+                check = self.writes % self.check_every == 0
+            if check:
+                self.evict(connection)
+        except sqlite3.Error:
+            logger.exception('writing to the shared cache %s failed', self.path)
+            with self.lock:
+                self.errors += 1
+
+    #drops the entries used longest ago until the file is back to 90% of its limit
+    def evict(self, connection):
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - self.max_bytes * 0.9
+        dropped = []
+        freed = 0
+        for key, version, size in connection.execute('SELECT key, version, size FROM entries ORDER BY used').fetchall():
+            if freed >= target:
+                break
+            dropped.append((key, version))
+            freed += size
+        connection.execute('BEGIN')
+        try:
+            connection.executemany('DELETE FROM entries WHERE key = ? AND version = ?', dropped)
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        with self.lock:
+            self.evictions += len(dropped)
+
+    def clear(self):
+        try:
+            self.connection().execute('DELETE FROM entries')
+        except sqlite3.Error:
+            logger.exception('clearing the shared cache %s failed', self.path)
+
+    #the counts are for this worker, the entries and bytes are for the whole file
+    def stats(self):
+        try:
+            entries, size = self.connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        with self.lock:
+            return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'errors': self.errors}
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+#the year range view needs totals for every team over any span of years, adding up the games each time is too slow
+#so at load time we count every team's games for each year and venue into one array, the "cube",
+#and keep running totals over the years. The totals for first..last are then the running total at last minus the
+#running total before first, which is one subtraction per team however many years the range covers
+
+#the numbers kept for each team, year and venue
+STATS = ['played', 'wins', 'draws', 'losses', 'goals_for', 'goals_against']
+
+#the venues along the third axis, 'All' is Home plus Away
+VENUES = ['Home', 'Away', 'All']
+
+
+class StatsCube(object):
+
+    def __init__(self, teams, first_year, prefix):
+        #the teams in sorted order, a team's position here is its row in the cube
+        self.teams = teams
+        self.first_year = first_year
+        #running totals with shape (teams, years + 1, venues, stats), prefix[:, i] is the total of the years before
+        #first_year + i, so prefix[:, 0] is all zeros
+        self.prefix = prefix
+        self.last_year = first_year + prefix.shape[1] - 2
+
+    #the positions in the prefix array for the years first..last, clipped to the years we have
+    def span(self, first, last):
+        first = min(max(first, self.first_year), self.last_year + 1)
+        last = min(max(last, first - 1), self.last_year)
+        return first - self.first_year, last - self.first_year + 1
+
+    #every team's totals for the years first..last, one row per team
+    def range_totals(self, first, last, venue):
+        start, stop = self.span(first, last)
+        venue = VENUES.index(venue)
+        totals = self.prefix[:, stop, venue] - self.prefix[:, start, venue]
+        frame = pd.DataFrame(totals, columns=STATS)
+        frame.insert(0, 'team', self.teams)
+        return frame
+
+    #one team's totals for each year from first to last, one row per year
+    def team_years(self, team, first, last, venue):
+        start, stop = self.span(first, last)
+        position = np.searchsorted(self.teams, team)
+        if position == len(self.teams) or self.teams[position] != team:
+            frame = pd.DataFrame(np.zeros((stop - start, len(STATS)), dtype=np.int64), columns=STATS)
+        else:
+            frame = pd.DataFrame(np.diff(self.prefix[position, start:stop + 1, VENUES.index(venue)], axis=0),
+                                 columns=STATS)
+        frame.insert(0, 'year', np.arange(start, stop) + self.first_year)
+        return frame
+
+
+#counts the rows of a long table into an array of shape (len(teams), years, venues, stats)
+#team_codes is the position of each row's team in teams
+#every stat is one np.bincount over a flat position, so there is no python loop over the games
+def count_games(long_table, team_codes, teams, first_year, years):
+    year_codes = long_table['year'].to_numpy() - first_year
+    venue_codes = long_table['venue'].cat.codes.to_numpy().astype(np.intp)
+    cells = (team_codes * years + year_codes) * 2 + venue_codes
+    goals_for = long_table['goals_for'].to_numpy()
+    goals_against = long_table['goals_against'].to_numpy()
+    net = goals_for - goals_against
+    values = [np.ones(len(cells)), net > 0, net == 0, net < 0, goals_for, goals_against]
+    counts = np.zeros((len(teams), years, len(VENUES), len(STATS)), dtype=np.int64)
+    size = len(teams) * years * 2
+    for i, value in enumerate(values):
+        counts[:, :, :2, i] = np.bincount(cells, weights=value, minlength=size).reshape(len(teams), years, 2)
+    counts[:, :, 2] = counts[:, :, 0] + counts[:, :, 1]
+    return counts
+
+
+#the teams of the cube are the long table's team dictionary, so the codes are used as they are
+def build_stats_cube(long_table):
+    teams = np.asarray(long_table['team'].cat.categories, dtype=object)
+    team_codes = long_table['team'].cat.codes.to_numpy().astype(np.intp)
+    first_year = int(long_table['year'].min())
+    years = int(long_table['year'].max()) - first_year + 1
+    counts = count_games(long_table, team_codes, teams, first_year, years)
+    prefix = np.zeros((len(teams), years + 1, len(VENUES), len(STATS)), dtype=np.int64)
+    np.cumsum(counts, axis=1, out=prefix[:, 1:])
+    return StatsCube(teams, first_year, prefix)
+
+
+#adds newly played games to a cube, the old cube is not changed
+#new games are never earlier than the last year we have, so only the running totals from their years onwards change
+def extend_stats_cube(cube, new_long):
+    #the new rows may all be fixtures that have not been played, which add nothing
+    if not len(new_long):
+        return cube
+    teams = np.union1d(cube.teams, new_long['team'].to_numpy())
+    last_year = max(cube.last_year, int(new_long['year'].max()))
+    years = last_year - cube.first_year + 1
+    prefix = np.zeros((len(teams), years + 1, len(VENUES), len(STATS)), dtype=np.int64)
+    #the old running totals go into the rows of their teams, and carry on flat into any new years
+    rows = np.searchsorted(teams, cube.teams)
+    old_years = cube.prefix.shape[1]
+    prefix[rows, :old_years] = cube.prefix
+    prefix[rows, old_years:] = cube.prefix[:, -1:]
+    team_codes = np.searchsorted(teams, np.asarray(new_long['team'].cat.categories, dtype=object))[
+        new_long['team'].cat.codes.to_numpy()]
+    prefix[:, 1:] += np.cumsum(count_games(new_long, team_codes, teams, cube.first_year, years), axis=1)
+    return StatsCube(teams, cube.first_year, prefix)
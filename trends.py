@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+#the form and trend of every team at every game, worked out for all of the teams at once
+#for each game we take the team's last `window` games up to and including it, and keep:
+#
+#    form    the average net goals of those games
+#    points  the average points of those games, 3 for a win and 1 for a draw
+#    slope   the straight line that best fits their net goals, as the change in net goals per game
+#    trend   where that line is at this game
+#
+#the long table has each team's games together in date order, so these all come from running totals over the whole
+#table: the sum over a team's last games is the running total now minus the running total `window` games ago,
+#or at the start of the team's block if it has played fewer. The line is a least squares fit worked out from the
+#sums of x, y, xy and xx the same way, with x the game's number in the team's history
+#the form and trend go into the long table next to each game, and each team's latest values into a summary with
+#one row per team, which is what the form ranking is read from
+#when new games arrive only the teams that played carry on, from their last `window` games before the new ones
+
+
+#a running sum over each team's last `window` rows, starts is where each row's team block starts
+def rolling_sums(values, starts, window):
+    totals = np.r_[0.0, np.cumsum(values, dtype=np.float64)]
+    rows = np.arange(len(values))
+    first = np.maximum(rows + 1 - window, starts)
+    return totals[rows + 1] - totals[first], rows + 1 - first
+
+
+#the blocks of a table sorted by team, as the first row of each block and the team's name
+def team_blocks(teams):
+    teams = np.asarray(teams, dtype=object)
+    starts = np.flatnonzero(np.r_[True, teams[1:] != teams[:-1]]) if len(teams) else np.array([], dtype=np.intp)
+    return starts, teams[starts]
+
+
+#the form, points, slope and trend at each row of a table sorted by team and date
+#before is how many games each row's team had played before the first of its rows in the table, when the table
+#only has a team's latest games, so x still counts from the team's first game
+def rolling_trends(table, window, before=None):
+    starts, names = team_blocks(table['team'])
+    lengths = np.diff(np.r_[starts, len(table)])
+    row_starts = np.repeat(starts, lengths)
+
+    net = table['goals_for'].to_numpy().astype(np.float64) - table['goals_against'].to_numpy()
+    points = np.where(net > 0, 3.0, np.where(net == 0, 1.0, 0.0))
+    #x is the game's number in the team's history
+    x = (np.arange(len(net)) - row_starts).astype(np.float64)
+    if before is not None:
+        x += np.repeat(np.asarray(before, dtype=np.float64), lengths)
+
+    sum_y, count = rolling_sums(net, row_starts, window)
+    sum_points = rolling_sums(points, row_starts, window)[0]
+    sum_x = rolling_sums(x, row_starts, window)[0]
+    sum_xy = rolling_sums(x * net, row_starts, window)[0]
+    sum_xx = rolling_sums(x * x, row_starts, window)[0]
+
+    #the least squares line, with a single game there is no line and it is flat
+    spread = count * sum_xx - sum_x * sum_x
+    slope = np.divide(count * sum_xy - sum_x * sum_y, spread, out=np.zeros(len(net)), where=spread > 0.5)
+    intercept = (sum_y - slope * sum_x) / np.maximum(count, 1)
+    return pd.DataFrame({'form': sum_y / np.maximum(count, 1), 'points': sum_points / np.maximum(count, 1),
+                         'slope': slope, 'trend': intercept + slope * x})
+
+
+#one row per team from the last row of each of its blocks: how many games it has played, its first and last game
+#and its latest form, points and slope
+def block_summary(table, values, games, first_games):
+    starts, names = team_blocks(table['team'])
+    last = (np.r_[starts, len(table)] - 1)[1:]
+    dates = table['date'].to_numpy()
+    return pd.DataFrame({'games': games, 'first_game': first_games, 'last_game': dates[last],
+                         'form': values['form'].to_numpy()[last], 'points': values['points'].to_numpy()[last],
+                         'slope': values['slope'].to_numpy()[last]}, index=pd.Index(names, name='team'))
+
+
+#the form and trend of every game of the long table, and the summary of every team
+def build_trends(long_table, window):
+    values = rolling_trends(long_table, window)
+    starts, names = team_blocks(long_table['team'])
+    summary = block_summary(long_table, values, np.diff(np.r_[starts, len(long_table)]),
+                            long_table['date'].to_numpy()[starts])
+    return values, summary
+
+
+#the form and trend of new_long's games, and the summary with the teams that played in them brought up to date
+#history has each of those teams' last window - 1 games before the new ones, with the same columns as new_long
+#new_long and the old summary are not changed
+def extend_trends(summary, history, new_long, window):
+    columns = ['team', 'goals_for', 'goals_against', 'date', 'match']
+    table = pd.concat([history[columns].assign(team=np.asarray(history['team'], dtype=object), row=-1),
+                       new_long[columns].assign(team=np.asarray(new_long['team'], dtype=object),
+                                                row=np.arange(len(new_long)))], ignore_index=True)
+    table = table.sort_values(['team', 'date', 'match'], kind='mergesort').reset_index(drop=True)
+    starts, names = team_blocks(table['team'])
+    lengths = np.diff(np.r_[starts, len(table)])
+    played = summary['games'].reindex(names).fillna(0).to_numpy().astype(np.int64)
+    kept = pd.Series(np.asarray(history['team'], dtype=object)).value_counts().reindex(names).fillna(0)
+    values = rolling_trends(table, window, before=played - kept.to_numpy().astype(np.int64))
+
+    #the new games go back in new_long's order
+    rows = table['row'].to_numpy()
+    new = np.flatnonzero(rows >= 0)
+    order = np.empty(len(new), dtype=np.intp)
+    order[rows[new]] = new
+    first_games = summary['first_game'].reindex(names).to_numpy()
+    first_games = np.where(played > 0, first_games, table['date'].to_numpy()[starts])
+    new_counts = lengths - kept.to_numpy().astype(np.int64)
+    changed = block_summary(table, values, played + new_counts, first_games)
+    return values.iloc[order].reset_index(drop=True), pd.concat([summary.drop(names, errors='ignore'),
+                                                                changed]).sort_index()
+
+
+#every team's latest form, for the teams that have played at least `window` games and have played in the
+#active_years before the last game we have, so teams that no longer play drop out
+def form_ranking(summary, window, active_years):
+    if not len(summary):
+        return pd.DataFrame(columns=['team', 'last_game', 'form', 'points', 'trend'])
+    since = pd.Timestamp(summary['last_game'].max()) - pd.DateOffset(years=active_years)
+    latest = summary[(summary['games'] >= window) & (summary['last_game'] >= since)]
+    return pd.DataFrame({'team': np.asarray(latest.index, dtype=object),
+                         'last_game': pd.to_datetime(latest['last_game']).dt.strftime('%Y-%m-%d').to_numpy(),
+                         'form': latest['form'].round(2).to_numpy(), 'points': latest['points'].round(2).to_numpy(),
+                         'trend': latest['slope'].round(3).to_numpy()})
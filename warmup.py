@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#after a deploy every worker starts with an empty figure cache, so the first visitors pay for building the popular
+#views. This builds a list of views in the background, with a few threads, while the worker is already serving
+#the tasks are run in the order they are given, so the views people are most likely to open should come first
+#progress is logged every so often, and the counts and the time taken are put on /metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup(object):
+
+    def __init__(self, threads=2, log_every=50):
+        self.threads = threads
+        self.log_every = log_every
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.started = None
+        self.seconds = 0.0
+        self.running = False
+        self.lock = threading.Lock()
+
+    #runs the tasks in a background thread and returns straight away, tasks is a list of (label, function) pairs
+    #wrap is called around each task, the app uses it to give the task a request context
+    #if a warm up is already running the new one is skipped, the running one will carry on
+    def start(self, tasks, wrap=None):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.total, self.done, self.failed = len(tasks), 0, 0
+            self.started, self.seconds = time.time(), 0.0
+        threading.Thread(target=self.run, args=(tasks, wrap), name='warmup', daemon=True).start()
+        return True
+
+    def run(self, tasks, wrap):
+        start = time.perf_counter()
+        logger.info('warming up %d views with %d threads', len(tasks), self.threads)
+
+        def task(item):
+            label, function = item
+            try:
+                if wrap is None:
+                    function()
+                else:
+                    wrap(function)
+                failed = False
+            except Exception:
+                logger.exception('warming up %s failed', label)
+                failed = True
+            with self.lock:
+                self.done += 1
+                self.failed += failed
+                self.seconds = time.perf_counter() - start
+                done = self.done
+            if done % self.log_every == 0 and done < len(tasks):
+                logger.info('warmed up %d of %d views in %.1fs', done, len(tasks), time.perf_counter() - start)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                list(pool.map(task, tasks))
+        finally:
+            with self.lock:
+                self.running = False
+                self.seconds = time.perf_counter() - start
+            logger.info('warmed up %d views in %.1fs (%d failed)', self.done, self.seconds, self.failed)
+
+    def stats(self):
+        with self.lock:
+            return {'tasks': self.total, 'done': self.done, 'failed': self.failed,
+                    'seconds': round(self.seconds, 3), 'running': int(self.running)}
+
+    #the lines for /metrics
+    def collect(self):
+        stats = self.stats()
+        return ['# TYPE warmup_{} gauge\nwarmup_{} {}'.format(name, name, value) for name, value in sorted(stats.items())]